@@ -5,15 +5,20 @@ Expectation-Maximization.
 
 import logging
 import numpy as np
-import scipy.linalg
-from scipy.special import logsumexp
 from tqdm import tqdm
 
 from .mml import (gaussian_mixture_message_length,
-                  gmm_component_contributions_to_message_length)
+                  gmm_component_contributions_to_message_length,
+                  total_message_length)
 
 logger = logging.getLogger(__name__)
 
+_LOG_2PI = np.log(2 * np.pi)
+
+# The largest number of elements in the (K, N, D) array of differences that is
+# built at once when estimating covariance matrices.
+_COVARIANCE_CHUNK_SIZE = 2**16
+
 
 def expectation(y, means, covs, weights, **kwargs):
     r"""
@@ -46,25 +51,86 @@ def expectation(y, means, covs, weights, **kwargs):
     kwds = kwargs.copy()
     kwds.pop("full_output", False)
 
-    R, ll = responsibilities(y, means, covs, weights, 
-                             full_output=True, **kwds)
-
     K, N, D = (weights.size, *y.shape)
 
+    # Factorise the covariance matrices once, and use the same factors for the
+    # responsibilities and the log of the determinant of the covariances.
+    covariance_type = kwds.get("covariance_type", "full")
+    precision_cholesky = _compute_precision_cholesky(covs, covariance_type)
+
+    R, ll = responsibilities(y, means, covs, weights, full_output=True,
+                             precision_cholesky=precision_cholesky, **kwds)
+
+    slogdetcovs = -2 * _log_det_cholesky(precision_cholesky, covariance_type, D)
+
     I = gaussian_mixture_message_length(K, N, D, np.sum(ll), 
-                                        np.sum(np.linalg.slogdet(covs)[1]),
-                                        [weights])
+                                        np.sum(slogdetcovs), [weights])
 
     return (R, ll, I)
 
 
+def _weighted_log_prob(y, means, covs, weights, covariance_type="full",
+                       **kwargs):
+    r"""
+    Return the weighted log-probability of the data under each component, and
+    the log of the determinant of each covariance matrix.
+
+    These are the per-component parts of the expectation step. When a mixture
+    is perturbed by changing only some components, the parts of the other
+    components can be reused.
+
+    :param y:
+        The data values, :math:`y`, which are expected to have :math:`N` samples
+        each with :math:`D` dimensions. Expected shape of ``y`` is 
+        :math:`(N, D)`.
+
+    :param means:
+        The current estimate of the multivariate means of the :math:`K`
+        components. The expected shape of ``means`` is :math:`(K, D)`.
+
+    :param covs:
+        The current estimate of the covariance matrices of the :math:`K`
+        components. The expected shape of ``covs`` is :math:`(K, D, D)`.
+
+    :param weights:
+        The current estimate of the relative weights :math:`w` of all :math:`K`
+        components. The expected shape of ``weights`` is :math:`(K, )`.
+
+    :param covariance_type: [optional]
+        The structure of the covariance matrices (default: ``"full"``).
+
+    :returns:
+        A two-length tuple containing the weighted log-probability of the data,
+        with shape :math:`(N, K)`, and the log of the determinant of each
+        covariance matrix.
+    """
+
+    D = y.shape[1]
+    precision_cholesky = _compute_precision_cholesky(covs, covariance_type)
+
+    log_prob = _gaussian_log_prob(y, means, weights, precision_cholesky,
+                                  covariance_type)
+    slogdetcovs = -2 * _log_det_cholesky(precision_cholesky, covariance_type, D)
+
+    return (log_prob, slogdetcovs)
+
+
 def _component_expectations(y, means, covs, weights, **kwargs):
 
-    R, ll = responsibilities(y, means, covs, weights, 
-                             full_output=True, **kwargs)
+    kwds = kwargs.copy()
+    kwds.pop("full_output", False)
+
+    D = y.shape[1]
+    covariance_type = kwds.get("covariance_type", "full")
+    precision_cholesky = _compute_precision_cholesky(covs, covariance_type)
+
+    R, ll = responsibilities(y, means, covs, weights, full_output=True,
+                             precision_cholesky=precision_cholesky, **kwds)
 
+    slogdetcovs = -2 * _log_det_cholesky(precision_cholesky, covariance_type, D)
 
-    I_components = gmm_component_contributions_to_message_length(R, ll, covs, weights)
+    I_components = gmm_component_contributions_to_message_length(
+        R, ll, covs, weights, slogdetcovs=slogdetcovs)
 
     return (R, ll, I_components)
     
@@ -116,10 +182,8 @@ def maximization(y, means, covs, weights, responsibilities,
     weighted_responsibilities = parent_responsibilities * responsibilities
     w_effective_membership = np.sum(weighted_responsibilities, axis=1)
 
-    means_, covs_ = (np.zeros_like(means), np.zeros_like(covs))
-    for k in range(K):
-        means_[k] = np.sum(weighted_responsibilities[k] * y.T, axis=1) \
-                  / w_effective_membership[k]
+    means_ = np.dot(weighted_responsibilities, y) \
+           / w_effective_membership[:, np.newaxis]
 
     covs_ = _estimate_covariance_matrix(y, means_, responsibilities, **kwargs)
 
@@ -174,6 +238,11 @@ def expectation_maximization(y, means, covs, weights, covariance_type="full",
     :param quiet: [optional]
         Optionally turn off progress bars.
 
+    :param initial_expectation: [optional]
+        The responsibilities, the log-likelihood, and the message lengths of
+        the given mixture, if they are already known. If given, the first
+        expectation step is skipped.
+
     :returns:
         A four-length tuple containing:
 
@@ -193,18 +262,23 @@ def expectation_maximization(y, means, covs, weights, covariance_type="full",
     callback_step = kwargs.pop("__callback_function", None)
 
     R = kwargs.pop("responsibilities", None)
+    initial_expectation = kwargs.pop("initial_expectation", None)
 
     kwds = dict(covariance_type=covariance_type,
                 covariance_regularization=covariance_regularization)
     kwds.update(kwargs)
 
     state = (means, covs, weights)
-    responsibilities, ll, I = e_step(y, *state, **kwds)
+    if initial_expectation is None:
+        responsibilities, ll, I = e_step(y, *state, **kwds)
+
+    else:
+        responsibilities, ll, I = initial_expectation
 
     # Overwrite responsibilities if explicitly given.
     if R is not None: responsibilities = R
 
-    prev_I = np.sum(np.hstack(I.values()))
+    prev_I = total_message_length(I)
 
     tqdm_kwds = dict(disable=True) if quiet \
                                    else dict(desc=f"E-M @ K={weights.size}")
@@ -214,7 +288,7 @@ def expectation_maximization(y, means, covs, weights, covariance_type="full",
         state = m_step(y, *state, responsibilities, **kwds)
         responsibilities, ll, I = e_step(y, *state, **kwds)
 
-        current_I = np.sum(np.hstack(I.values()))
+        current_I = total_message_length(I)
         diff = np.abs(prev_I - current_I)
         if diff <= threshold or not np.isfinite(diff):
             break
@@ -232,7 +306,7 @@ def expectation_maximization(y, means, covs, weights, covariance_type="full",
 
 
 def responsibilities(y, means, covs, weights, covariance_type="full",
-                     full_output=False, **kwargs):
+                     full_output=False, precision_cholesky=None, **kwargs):
     r"""
     Return the responsibility matrix,
 
@@ -276,22 +350,35 @@ def responsibilities(y, means, covs, weights, covariance_type="full",
         If ``True``, return the responsibility matrix, and the log likelihood,
         which is evaluated for free (default: ``False``).
 
+    :param precision_cholesky: [optional]
+        The Cholesky decomposition of the precision of the covariance matrices,
+        if it has already been computed.
+
     :returns:
         The responsibility matrix. If ``full_output`` is ``True``, then the
         log-likelihood (per observation) will also be returned.
     """
 
-    precision_cholesky = _compute_precision_cholesky(covs, covariance_type)
+    if precision_cholesky is None:
+        precision_cholesky = _compute_precision_cholesky(covs, covariance_type)
     lp = _gaussian_log_prob(y, means, weights, precision_cholesky,
                             covariance_type)
         
-    ll = logsumexp(lp, axis=1)
+    # Evaluate the log-sum-exp by hand so that the exponentials it needs are
+    # reused as the (unnormalised) responsibilities, in place.
+    lp_max = np.max(lp, axis=1)
+    lp_max[~np.isfinite(lp_max)] = 0
+
+    lp -= lp_max[:, np.newaxis]
     with np.errstate(under="ignore"):
-        log_R = lp - ll[:, np.newaxis]
+        R = np.exp(lp, out=lp)
 
-    R = np.exp(log_R).T
+    norm = np.sum(R, axis=1)
+    R /= norm[:, np.newaxis]
 
-    return (R, ll) if full_output else R
+    ll = lp_max + np.log(norm)
+
+    return (R.T, ll) if full_output else R.T
 
 
 def _compute_precision_cholesky(covariances, covariance_type):
@@ -319,35 +406,82 @@ def _compute_precision_cholesky(covariances, covariance_type):
         The Cholesky decomposition of the precision of the covariance matrices.
     """
 
-    singular_matrix_error = "Failed to do Cholesky decomposition"
+    try:
+        function = _precision_cholesky_functions[covariance_type]
+
+    except KeyError:
+        raise NotImplementedError(f"unknown covariance type '{covariance_type}'")
+
+    return function(covariances)
+
+
+def _compute_precision_cholesky_full(covariances):
+    r"""
+    Compute the Cholesky decomposition of the precision of full covariance
+    matrices.
 
-    if covariance_type in "full":
-        K, D, _ = covariances.shape
+    :param covariances:
+        An array of covariance matrices, with shape :math:`(K, D, D)`.
 
-        I = np.eye(D)
+    :returns:
+        The Cholesky decomposition of the precision of the covariance matrices.
+    """
 
-        cholesky_precision = np.empty((K, D, D))
-        for k, covariance in enumerate(covariances):
-            try:
-                cholesky_cov = scipy.linalg.cholesky(covariance, lower=True) 
+    K, D, _ = covariances.shape
 
-            except scipy.linalg.LinAlgError:
-                raise ValueError(singular_matrix_error)
+    # Factorise all components in one batched call rather than crossing into
+    # LAPACK once per component.
+    try:
+        cholesky_cov = np.linalg.cholesky(covariances)
 
-            cholesky_precision[k] = scipy.linalg.solve_triangular(
-                                    cholesky_cov, I, lower=True).T
+    except np.linalg.LinAlgError:
+        raise ValueError(_singular_matrix_error)
 
-    elif covariance_type in "diag":
-        if np.any(np.less_equal(covariances, 0.0)):
-            raise ValueError(singular_matrix_error)
-        cholesky_precision = covariances**(-0.5)
+    # Non-finite covariances do not always raise in the batched call.
+    if not np.all(np.isfinite(cholesky_cov)):
+        raise ValueError(_singular_matrix_error)
 
-    else:
-        raise NotImplementedError(f"unknown covariance type '{covariance_type}'")
+    I = np.broadcast_to(np.eye(D), (K, D, D))
+    cholesky_precision = np.linalg.solve(cholesky_cov, I).transpose(0, 2, 1)
 
     return cholesky_precision
 
 
+def _compute_precision_cholesky_diag(covariances):
+    r"""
+    Compute the Cholesky decomposition of the precision of diagonal covariance
+    matrices.
+
+    :param covariances:
+        An array of the diagonals of covariance matrices, with shape 
+        :math:`(K, D)`.
+
+    :returns:
+        The Cholesky decomposition of the precision of the covariance matrices.
+    """
+
+    # Non-positive variances give non-finite values, so the validation can be
+    # done on the result rather than in a separate pass over the input.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cholesky_precision = np.sqrt(covariances)
+        np.reciprocal(cholesky_precision, out=cholesky_precision)
+
+    if not np.all(np.isfinite(cholesky_precision)):
+        raise ValueError(_singular_matrix_error)
+
+    return cholesky_precision
+
+
+_singular_matrix_error = "Failed to do Cholesky decomposition"
+
+# Resolve the covariance type to the specialised function once, rather than
+# comparing strings on every call.
+_precision_cholesky_functions = {
+    "full": _compute_precision_cholesky_full,
+    "diag": _compute_precision_cholesky_diag
+}
+
+
 def _estimate_covariance_matrix(y, means, responsibilities, covariance_type,
                                 covariance_regularization=0, **kwargs):
     r"""
@@ -383,13 +517,8 @@ def _estimate_covariance_matrix(y, means, responsibilities, covariance_type,
         An estimate of the covariance matrices of the Gaussian components.
     """
 
-    available = {
-        "full": _estimate_covariance_matrix_full,
-        "diag": _estimate_covariance_matrix_diag
-    }
-
     try:
-        function = available[covariance_type]
+        function = _covariance_matrix_functions[covariance_type]
 
     except KeyError:
         raise ValueError(f"unknown covariance type '{covariance_type}'")
@@ -431,14 +560,72 @@ def _estimate_covariance_matrix_full(y, means, responsibilities,
 
     membership = np.sum(responsibilities, axis=1)
 
-    I = np.eye(D)
+    # Form the weighted scatter about each mean from the centred differences.
+    # This is the batched product 'kn,knd,kne->kde', evaluated for as many
+    # components at a time as fit in a small array of differences. Expanding
+    # the scatter into moments of the data instead would cancel badly for
+    # tight components far from the origin.
+    covs = np.empty((K, D, D))
+    step = max(1, _COVARIANCE_CHUNK_SIZE // (N * D))
+    for start in range(0, K, step):
+        end = start + step
+        diff = y - means[start:end, np.newaxis]
+        covs[start:end] = np.matmul(
+            responsibilities[start:end, np.newaxis] * diff.transpose(0, 2, 1),
+            diff)
+
+    denominator = np.where(membership > 1, membership - 1, membership)
+    covs /= denominator[:, np.newaxis, np.newaxis]
+    np.einsum("kii->ki", covs)[:] += covariance_regularization
+
+    return covs
+
+
+def _estimate_covariance_matrix_full_from_labels(y, means, labels,
+                                                 covariance_regularization=0):
+    r"""
+    Estimate the covariance matrices given the data, a hard assignment of each
+    data point to one component, and an estimate of the means of the Gaussian
+    components. This is equivalent to `_estimate_covariance_matrix_full` with
+    a one-hot responsibility matrix, but each data point only enters the
+    estimate of the component it is assigned to.
+
+    :param y:
+        The data values, :math:`y`, which are expected to have :math:`N` samples
+        each with :math:`D` dimensions. Expected shape of ``y`` is 
+        :math:`(N, D)`.
+
+    :param means:
+        The current estimate of the multivariate means of the :math:`K`
+        components. The expected shape of ``means`` is :math:`(K, D)`.
+
+    :param labels:
+        The index of the component that each data point is assigned to. The
+        expected shape of ``labels`` is :math:`(N, )`.
+
+    :param covariance_regularization: [optional]
+        A regularization term that is added to the diagonal of the covariance
+        matrices. Default is 0.
+
+    :returns:
+        An estimate of the covariance matrices of the Gaussian components.
+    """
+
+    K, D = means.shape
+
+    membership = np.bincount(labels, minlength=K)
+    members = np.split(y[np.argsort(labels, kind="stable")], 
+                       np.cumsum(membership)[:-1])
+
     covs = np.empty((K, D, D))
-    for k, (mean, R, M) in enumerate(zip(means, responsibilities, membership)):
-        diff = y - mean
+    for k, (mean, y_k, M) in enumerate(zip(means, members, membership)):
+        diff = y_k - mean
         denominator = M - 1 if M > 1 else M
 
-        covs[k] = np.dot(R * diff.T, diff) / denominator \
-                + covariance_regularization * I
+        covs[k] = np.dot(diff.T, diff) / denominator
+
+    # Regularise through a view of the diagonals.
+    np.einsum("kii->ki", covs)[:] += covariance_regularization
 
     return covs
 
@@ -482,19 +669,31 @@ def _estimate_covariance_matrix_diag(y, means, responsibilities,
     N, D = y.shape
     K, N = responsibilities.shape
 
-    denominator = np.sum(responsibilities, axis=1)
-    denominator[denominator > 1] = denominator[denominator > 1] - 1
-    memberships = np.sum(responsibilities, axis=1)
+    membership = np.sum(responsibilities, axis=1)
 
+    # As for full covariance matrices, form the weighted scatter from the
+    # centred differences for a batch of components at a time.
     covs = np.empty((K, D))
-    for k, (mean, R, M) in enumerate(zip(means, responsibilities, memberships)):
-        diff = y - mean
-        denominator = M - 1 if M > 1 else M
-        covs[k] = np.dot(R, diff**2) / denominator + covariance_regularization
+    step = max(1, _COVARIANCE_CHUNK_SIZE // (N * D))
+    for start in range(0, K, step):
+        end = start + step
+        diff = y - means[start:end, np.newaxis]
+        covs[start:end] = np.matmul(
+            responsibilities[start:end, np.newaxis], diff**2)[:, 0]
+
+    denominator = np.where(membership > 1, membership - 1, membership)
+    covs /= denominator[:, np.newaxis]
+    covs += covariance_regularization
 
     return covs
 
-    
+
+_covariance_matrix_functions = {
+    "full": _estimate_covariance_matrix_full,
+    "diag": _estimate_covariance_matrix_diag
+}
+
+
 
 def _log_det_cholesky(cholesky_decomposition, covariance_type, D):
     r"""
@@ -571,21 +770,86 @@ def _gaussian_log_prob(y, means, weights, precision_cholesky, covariance_type):
     N, D = y.shape
     K, D = means.shape
 
+    try:
+        function = _gaussian_log_prob_functions[covariance_type]
+
+    except KeyError:
+        raise NotImplementedError(f"unknown covariance type '{covariance_type}'")
+
     # Remember: det(precision_chol) is half of det(precision)
     log_det = _log_det_cholesky(precision_cholesky, covariance_type, D)
+    log_prob = function(y, means, precision_cholesky)
+
+    # Fold the normalisation and the log of the weights into one constant per
+    # component, and apply it in place to the (N, K) array.
+    log_prob *= -0.5
+    log_prob += np.log(weights) + log_det - 0.5 * D * _LOG_2PI
+    return log_prob
+
 
-    if covariance_type in 'full':
-        log_prob = np.empty((N, K))
-        for k, (mean, prec_chol) in enumerate(zip(means, precision_cholesky)):
-            diff = np.dot(y, prec_chol) - np.dot(mean, prec_chol)
-            log_prob[:, k] = np.sum(np.square(diff), axis=1)
+def _gaussian_log_prob_full(y, means, precision_cholesky):
+    r"""
+    Return the squared Mahalanobis distance of the data from each component,
+    given full covariance matrices.
+
+    :param y:
+        The data values, :math:`y`, with shape :math:`(N, D)`.
+
+    :param means:
+        The multivariate means of the :math:`K` components, with shape
+        :math:`(K, D)`.
+
+    :param precision_cholesky:
+        The Cholesky decomposition of the precision of the covariance matrices,
+        with shape :math:`(K, D, D)`.
+
+    :returns:
+        The squared Mahalanobis distances, with shape :math:`(N, K)`.
+    """
+
+    N, D = y.shape
+    K, D = means.shape
+
+    # Whiten the data for all components with a single matrix product by
+    # stacking the factors side by side, then subtract the whitened means in
+    # place and reduce the squares with einsum.
+    stacked = precision_cholesky.transpose(1, 0, 2).reshape((D, K * D))
+    diff = np.dot(y, stacked).reshape((N, K, D))
+    diff -= np.einsum("kd,kdf->kf", means, precision_cholesky)
+
+    return np.einsum("nkd,nkd->nk", diff, diff)
+
+
+def _gaussian_log_prob_diag(y, means, precision_cholesky):
+    r"""
+    Return the squared Mahalanobis distance of the data from each component,
+    given diagonal covariance matrices.
+
+    :param y:
+        The data values, :math:`y`, with shape :math:`(N, D)`.
+
+    :param means:
+        The multivariate means of the :math:`K` components, with shape
+        :math:`(K, D)`.
+
+    :param precision_cholesky:
+        The Cholesky decomposition of the precision of the covariance matrices,
+        with shape :math:`(K, D)`.
+
+    :returns:
+        The squared Mahalanobis distances, with shape :math:`(N, K)`.
+    """
 
-    elif covariance_type in 'diag':
-        precisions = precision_cholesky**2
-        log_prob = (np.sum((means**2 * precisions), 1) \
-                 - 2.0 * np.dot(y, (means * precisions).T) \
-                 + np.dot(y**2, precisions.T))
+    # Accumulate the expanded square into one (N, K) array in place, rather
+    # than allocating a temporary of that size for every term.
+    precisions = precision_cholesky**2
+    log_prob = np.dot(y**2, precisions.T)
+    log_prob -= np.dot(y, (2.0 * means * precisions).T)
+    log_prob += np.sum(means**2 * precisions, axis=1)
+    return log_prob
 
-    ll = -0.5 * (D * np.log(2 * np.pi) + log_prob) + log_det
-    return np.log(weights) + ll
 
+_gaussian_log_prob_functions = {
+    "full": _gaussian_log_prob_full,
+    "diag": _gaussian_log_prob_diag
+}
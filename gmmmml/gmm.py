@@ -8,6 +8,7 @@ __all__ = ["GaussianMixture"]
 import logging
 import numpy as np
 from collections import OrderedDict
+from threading import Lock
 from time import time
 
 from . import (mml, em, strategies)
@@ -73,19 +74,91 @@ class GaussianMixture(object):
                              covariance_regularization=covariance_regularization,
                              visualization_handler=visualization_handler)
 
-        # Lists to record states for predictive purposes.
-        self._state_K = []
-        self._state_I = []
-        self._state_weights = []
-        self._state_slog_weights = []
-        self._state_det_covs = []
-        self._state_slog_likelihoods = []
+        # Arrays to record states for predictive purposes. The scalar states
+        # are kept in buffers that grow as needed, so that predictions receive
+        # contiguous views instead of rebuilding arrays from lists. The 
+        # component states of all mixtures are concatenated in flat buffers,
+        # where each mixture starts at the recorded offset. The per-component
+        # statistics used only for predictions are stored in single precision.
+        # The per-mixture sums are not, because summed log-likelihoods are
+        # large enough that single precision would round them to the scale of
+        # the message length differences being predicted.
+        self._state_size = 0
+        self._state_buffers = dict(K=np.empty(32, dtype=int), 
+                                   I=np.empty(32),
+                                   offsets=np.empty(32, dtype=int),
+                                   slog_weights=np.empty(32),
+                                   slog_likelihoods=np.empty(32),
+                                   slog_det_covs=np.empty(32))
+        self._state_component_size = 0
+        self._state_component_buffers = dict(
+            weights=np.empty(256, dtype=np.float32),
+            slog_det_covs=np.empty(256, dtype=np.float32))
+        self._state_lock = Lock()
 
         self._state_meta = {}
 
         return None
 
 
+    @property
+    def _state_K(self):
+        r""" Return the number of components in all recorded states. """
+        return self._state_buffers["K"][:self._state_size]
+
+
+    @property
+    def _state_I(self):
+        r""" Return the message lengths of all recorded states. """
+        return self._state_buffers["I"][:self._state_size]
+
+
+    @property
+    def _state_slog_weights(self):
+        r""" Return the sum of the log of the weights of all recorded states. """
+        return self._state_buffers["slog_weights"][:self._state_size]
+
+
+    @property
+    def _state_slog_likelihoods(self):
+        r""" Return the sum of the log-likelihoods of all recorded states. """
+        return self._state_buffers["slog_likelihoods"][:self._state_size]
+
+
+    @property
+    def _state_sum_log_det_covs(self):
+        r"""
+        Return the sum of the log of the determinant of the covariance matrices
+        of all recorded states.
+        """
+        return self._state_buffers["slog_det_covs"][:self._state_size]
+
+
+    @property
+    def _state_offsets(self):
+        r""" 
+        Return the offsets of all recorded states in the flat component buffers.
+        """
+        return self._state_buffers["offsets"][:self._state_size]
+
+
+    @property
+    def _state_weights(self):
+        r""" Return the flattened weights of all recorded states. """
+        return self._state_component_buffers["weights"]\
+                   [:self._state_component_size]
+
+
+    @property
+    def _state_slog_det_covs(self):
+        r""" 
+        Return the flattened log of the determinant of the covariance matrices
+        of all recorded states.
+        """
+        return self._state_component_buffers["slog_det_covs"]\
+                   [:self._state_component_size]
+
+
     @property
     def covariance_type(self):
         r""" Return the type of covariance stucture assumed. """
@@ -154,7 +227,7 @@ class GaussianMixture(object):
         handler = kwargs.get("visualization_handler", None)
         if handler is not None:
             handler.emit("actual_I",
-                dict(K=weights.size, I=np.sum(np.hstack(I.values()))))
+                dict(K=weights.size, I=mml.total_message_length(I)))
 
             handler.emit("actual_I_weights", 
                          dict(K=weights.size, I=I["I_weights"]))
@@ -304,9 +377,23 @@ class GaussianMixture(object):
 
             Defaults to `strategies.MessageBreaking`, a fast and possibly convex
             optimisation search strategy.
+
+        :param n_jobs: [optional]
+            The number of threads to use when a policy trials independent
+            mixtures (default: `1`).
+
+        :param max_split_candidates: [optional]
+            The maximum number of components to trial splitting at each step
+            of a greedy perturbation search. Components are ranked by their
+            weight and the volume of their covariance matrix. If `None` is
+            given then every component is trialled (default: `None`).
         """
 
-        y = np.atleast_2d(y)
+        # Copy the data once to a contiguous array of floats, so that every
+        # expectation-maximization step works on the same memory layout.
+        y = np.ascontiguousarray(y, dtype=float)
+        if y.ndim != 2:
+            raise ValueError("y must be a two-dimensional array of shape (N, D)")
 
         t_init = time()
         
@@ -318,7 +405,7 @@ class GaussianMixture(object):
         kwds.update(__expectation_function=self.expectation,
                     __maximization_function=self.maximization,
                     __callback_function=lambda s, *a: \
-                        self._record_state_for_predictions(*s[1:], *a[1:]))
+                        self._record_state_for_predictions(*s[1:], a[-1]))
 
         if isinstance(search_strategy, str):
             try:
@@ -348,15 +435,6 @@ class GaussianMixture(object):
             # greedy repartition policies).
             self._results.update([strategy.repartition(y, K, **kwds)])
 
-            # This is to find the bug RE I not being a dict. No time now!
-            """
-            for k, v in self._results.items():
-                try:
-                    v[-1].values()
-                except AttributeError:
-                    raise
-            """
-
             index = np.nanargmin(self._state_I)
             K_best, I_best = (self._state_K[index], self._state_I[index])
             logger.debug(f"Best so far is K = {K_best} with I = {I_best}")
@@ -395,14 +473,20 @@ class GaussianMixture(object):
 
         K = np.atleast_1d(K)
 
+        # The predictions are always needed by the movement policies, so only
+        # the work done for the visualization handler can be skipped.
+        handler = kwargs.get("visualization_handler", None)
+
         # Prepare a dictionary that we will use for making predictions.
         data = dict(
             K=self._state_K,
             I=self._state_I,
+            offsets=self._state_offsets,
             weights=self._state_weights,
-            det_covs=self._state_det_covs,
+            slog_det_covs=self._state_slog_det_covs,
+            sum_log_det_covs=self._state_sum_log_det_covs,
             sum_log_weights=self._state_slog_weights,
-            negative_log_likelihood=-np.array(self._state_slog_likelihoods))
+            negative_log_likelihood=-self._state_slog_likelihoods)
 
         # Constant terms.
         I_other = mml.information_of_mixture_constants(K, N, D)
@@ -415,11 +499,13 @@ class GaussianMixture(object):
         # Sum of the log of the determinant of the covariance matrices.
         I_sum_log_det_covs, I_sum_log_det_covs_var, \
         I_sum_log_det_covs_lower, I_sum_log_det_covs_upper \
-            = mml.predict_information_of_sum_log_det_covs(K, D, data=data)
+            = mml.predict_information_of_sum_log_det_covs(K, D, data=data,
+                cache=self._state_meta)
 
         # Negative log-likelihood.
         I_data, I_data_var, I_data_lower \
-            = mml.predict_negative_sum_log_likelihood(K, N, D, data=data)
+            = mml.predict_negative_sum_log_likelihood(K, N, D, data=data,
+                cache=self._state_meta)
 
         # Predict total, given other predictions.
         I = I_other + I_sum_log_weights + I_sum_log_det_covs + I_data
@@ -430,7 +516,6 @@ class GaussianMixture(object):
         # TODO: Store the predictions somewhere?
 
         # Visualize the predictions.
-        handler = kwargs.get("visualization_handler", None)
         if handler is not None:
             handler.emit("predict_I_weights", dict(
                 K=K, I=I_sum_log_weights, 
@@ -455,8 +540,7 @@ class GaussianMixture(object):
         return (K, I, I_var, I_lower)
 
 
-    def _record_state_for_predictions(self, covs, weights, log_likelihoods,
-                                      message_length):
+    def _record_state_for_predictions(self, covs, weights, message_length):
         r"""
         Record the state of a Gaussian mixture in order to make predictions on
         future mixtures.
@@ -470,38 +554,101 @@ class GaussianMixture(object):
             :math:`K` components. The sum of weights must equal 1. The expected 
             shape of `weights` is :math:`(K, )`.
 
-        :param log_likelihoods:
-            The log-likelihood of each data point, given the model.
-
         :param message_length:
-            The message length of the current mixture.
+            The message length of the current mixture. The sum of the
+            log-likelihoods is taken from the message length of the data.
 
         :returns:
             A boolean indicating whether the state was recorded.
         """
 
         # Check that the state *should* be saved.
-        I = np.sum(np.hstack(message_length.values()))
+        I = mml.total_message_length(message_length)
 
+        # The message length already holds the negative sum of the
+        # log-likelihoods, so the data are not summed again.
         slog_weights = np.sum(np.log(weights))
-        detcovs = np.linalg.det(covs)
-        if not np.all(np.isfinite(np.hstack([covs.flatten(), weights,
-            log_likelihoods, I, slog_weights]))) or np.any(detcovs <= 0):
+        slog_likelihoods = -np.sum(message_length["I_data"])
+
+        # The covariance matrices are symmetric positive-definite, so the log
+        # of their determinants follow from the diagonals of their Cholesky
+        # factors.
+        try:
+            slog_det_covs = 2 * np.sum(np.log(np.diagonal(
+                np.linalg.cholesky(covs), axis1=1, axis2=2)), axis=1)
+
+        except np.linalg.LinAlgError:
+            slog_det_covs = np.nan * np.ones(weights.size)
+
+        # Any non-finite value propagates through a sum, so the reductions are
+        # checked instead of copying every value into one array.
+        sum_log_det_covs = np.sum(slog_det_covs)
+        if not np.all(np.isfinite([np.sum(covs), I, slog_weights,
+            slog_likelihoods, sum_log_det_covs])):
             logger.warn("Ignoring invalid state.")
             return False
 
-        self._state_K.append(weights.size)
-
-        # Record determinates of covariance matrices.
-        self._state_det_covs.append(detcovs)
+        # Mixtures may be trialled in parallel threads, so record the state of
+        # each mixture atomically.
+        with self._state_lock:
 
-        # Record sum of the log of the weights.
-        self._state_weights.append(weights)
-        self._state_slog_weights.append(slog_weights)
+            # Record the weights and the log of the determinates of covariance
+            # matrices.
+            offset = self._state_component_size
+            self._append_component_states(weights=weights,
+                                          slog_det_covs=slog_det_covs)
 
-        # Record log likelihood
-        self._state_slog_likelihoods.append(np.sum(log_likelihoods))
-        self._state_I.append(I)
+            # Record the sum of the log of the weights, the sum of the log 
+            # likelihood, the sum of the log of the determinants of the
+            # covariance matrices, and the message length.
+            self._append_state(K=weights.size, I=I, offsets=offset,
+                               slog_weights=slog_weights,
+                               slog_likelihoods=slog_likelihoods,
+                               slog_det_covs=sum_log_det_covs)
 
         return True
 
+
+    def _append_state(self, **kwargs):
+        r"""
+        Append scalar values to the state buffers, growing the buffers if they
+        are full.
+
+        :param \**kwargs:
+            The values to record, keyed by the name of the state buffer.
+        """
+
+        index = self._state_size
+        for key, value in kwargs.items():
+            buffer = self._state_buffers[key]
+            if index >= buffer.size:
+                buffer = self._state_buffers[key] \
+                       = np.resize(buffer, 2 * buffer.size)
+            buffer[index] = value
+
+        self._state_size += 1
+        return None
+
+
+    def _append_component_states(self, **kwargs):
+        r"""
+        Append the component values of one mixture to the flat component state
+        buffers, growing the buffers if they are full.
+
+        :param \**kwargs:
+            The component values to record, keyed by the name of the component
+            state buffer. All values must have the same length.
+        """
+
+        start = self._state_component_size
+        for key, values in kwargs.items():
+            end = start + values.size
+            buffer = self._state_component_buffers[key]
+            if end > buffer.size:
+                buffer = self._state_component_buffers[key] \
+                       = np.resize(buffer, max(end, 2 * buffer.size))
+            buffer[start:end] = values
+
+        self._state_component_size = end
+        return None
+
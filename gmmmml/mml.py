@@ -3,11 +3,20 @@ import scipy.optimize as op
 
 import george
 from george import (kernels, modeling)
-from scipy.special import (gammaln, logsumexp)
+from scipy.special import gammaln
 
 # TODO: move to utils?
 from . import utils
 
+_LOG_2 = np.log(2)
+_LOG_PI = np.log(np.pi)
+_LOG_2PI = np.log(2 * np.pi)
+
+# The log of (K - 1)! for the number of components in any practical mixture,
+# so that log-gamma does not need to be evaluated for integer K.
+_MAX_K = 1024
+_LOG_FACTORIAL = np.hstack([0, np.cumsum(np.log(np.arange(1, _MAX_K)))])
+
 
 # TODO: improve these docs. they are not consistent and the math is borked.
 
@@ -55,17 +64,15 @@ def gaussian_mixture_message_length(K, N, D, log_likelihood, slogdetcov, weights
         raise ValueError("the size of K and log_likelihood are different")
 
     # Calculate the different contributions of the message length so we can
-    # predict them.
+    # predict them. The weights of all mixtures are concatenated so that the
+    # sum of the log of the weights of each mixture is one reduction.
     w_size = np.array([len(w) for w in weights])
-    if not np.all(w_size == K):
+    if w_size.size != K.size or not np.all(w_size == K):
         raise ValueError("the size of the weights does not match K")
-    slogw = np.array([np.sum(np.log(w)) for w in weights])
+    slogw = np.add.reduceat(np.log(np.concatenate(weights)),
+                            np.cumsum(w_size) - w_size)
 
-    Q = gmm_number_of_parameters(K, D)
-
-    I_mixtures = K * np.log(2) * (1 - D/2.0) + gammaln(K) \
-        + 0.25 * (2.0 * (K - 1) + K * D * (D + 3)) * np.log(N)
-    I_parameters = 0.5 * np.log(Q * np.pi) - 0.5 * Q * np.log(2 * np.pi)
+    I_mixtures, I_parameters = _information_of_mixture_constants(K, N, D)
     
     I_data = -log_likelihood 
     # TODO: this requires a thinko
@@ -83,26 +90,46 @@ def gaussian_mixture_message_length(K, N, D, log_likelihood, slogdetcov, weights
     return I_parts
 
 
+def total_message_length(message_lengths):
+    r"""
+    Return the total message length of a Gaussian mixture, given the lengths of
+    each part of the message.
+
+    :param message_lengths:
+        A dictionary containing the message lengths of various parts of the
+        mixture, as returned by `gaussian_mixture_message_length`.
+    """
+    return np.sum(sum(message_lengths.values()))
+
+
 def gmm_component_contributions_to_message_length(responsibilities, 
                                                   log_likelihoods, 
-                                                  covs, weights):
+                                                  covs, weights,
+                                                  slogdetcovs=None):
     """
     Return the component-wise contributions to the message length.
+
+    :param slogdetcovs: [optional]
+        The log of the determinant of each covariance matrix, if it has already
+        been computed.
     """
     K, N = responsibilities.shape
-    K, D, _ = covs.shape
+    K, D = covs.shape[:2]
 
-    # TODO: Refactor with gaussian_mixture_message_length
     I_data = responsibilities @ -log_likelihoods
 
-    Q = gmm_number_of_parameters(K, D)
+    I_mixtures, I_parameters = _information_of_mixture_constants(K, N, D)
 
-    I_mixtures = K * np.log(2) * (1 - D/2.0) + gammaln(K) \
-        + 0.25 * (2.0 * (K - 1) + K * D * (D + 3)) * np.log(N)
-    I_parameters = 0.5 * np.log(Q * np.pi) - 0.5 * Q * np.log(2 * np.pi)
-    
+    if slogdetcovs is None:
+        # Diagonal covariance matrices are given by their diagonals, and the
+        # log of their determinants needs no factorisation.
+        if covs.ndim == 2:
+            slogdetcovs = np.sum(np.log(covs), axis=1)
+
+        else:
+            slogdetcovs = np.linalg.slogdet(covs)[1]
 
-    I_slogdetcovs = -0.5 * (D + 2) * np.linalg.slogdet(covs)[1]
+    I_slogdetcovs = -0.5 * (D + 2) * slogdetcovs
     I_weights = (0.25 * D * (D + 3) - 0.5) * np.log(weights)
 
     I_components = (I_mixtures + I_parameters)/K \
@@ -168,13 +195,55 @@ def information_of_mixture_constants(K, N, D):
         The dimensionality of the data.
     """
 
+    I_mixtures, I_parameters = _information_of_mixture_constants(K, N, D)
+    return (I_mixtures + I_parameters)
+
+
+def _information_of_mixture_constants(K, N, D):
+    r"""
+    Return the information to encode the constant terms related to the mixture
+    itself, and the information to encode the number of parameters, as 
+    described in `information_of_mixture_constants`.
+
+    :param K:
+        The number of components in the target Gaussian mixture.
+
+    :param N:
+        The number of data points.
+
+    :param D:
+        The dimensionality of the data.
+
+    :returns:
+        A two-length tuple containing :math:`I_{mixture}` and 
+        :math:`I_{parameters}`.
+    """
+
     Q = gmm_number_of_parameters(K, D)
 
-    I_mixtures = K * np.log(2) * (1 - D/2.0) + gammaln(K) \
+    I_mixtures = K * _LOG_2 * (1 - D/2.0) + _log_gamma(K) \
         + 0.25 * (2.0 * (K - 1) + K * D * (D + 3)) * np.log(N)
-    I_parameters = 0.5 * np.log(Q * np.pi) - 0.5 * Q * np.log(2 * np.pi)
+    I_parameters = 0.5 * (np.log(Q) + _LOG_PI) - 0.5 * Q * _LOG_2PI
 
-    return (I_mixtures + I_parameters)
+    return (I_mixtures, I_parameters)
+
+
+def _log_gamma(K):
+    r"""
+    Return :math:`\log\Gamma(K)`, using a table of log-factorials for integer
+    :math:`K` and falling back to `scipy.special.gammaln` otherwise.
+
+    :param K:
+        The number of components in the target Gaussian mixture. This can be
+        an array.
+    """
+
+    K_ = np.asarray(K)
+    if np.issubdtype(K_.dtype, np.integer) \
+    and np.all((K_ >= 1) & (K_ <= _MAX_K)):
+        return _LOG_FACTORIAL[K_ - 1]
+
+    return gammaln(K)
 
 
 def _bounds_of_sum_log_weights(K, N):
@@ -212,7 +281,7 @@ def _bounds_of_sum_log_weights(K, N):
         The lower and upper bound on :math:`\sum_{k=1}^{K}\log{w_k}`.
     """
     upper = -K * np.log(K)
-    lower = (K - 1) * np.log(2) - K * np.log(N) + np.log(N - 2 * K + 2)
+    lower = (K - 1) * _LOG_2 - K * np.log(N) + np.log(N - 2 * K + 2)
     return (lower, upper)
 
 
@@ -335,10 +404,11 @@ def predict_information_of_sum_log_weights(K, N, D, data=None):
     f = f if np.isfinite(f) else _default_f
     f_var = f_var if np.isfinite(f_var) and f_var > 0 else _default_f_var
 
-    # Now make predictions.
-    lower, upper = information_bounds_of_sum_log_weights(K, N, D)
-    I = lower + f * (upper - lower)
-    I_var = (np.sqrt(f_var) * (upper - lower))**2
+    # Now make predictions. The prediction is linear in f, so the variance
+    # propagates exactly.
+    I_range = I_upper - I_lower
+    I = I_lower + f * I_range
+    I_var = f_var * I_range**2
 
     return (I, I_var, I_lower, I_upper)
 
@@ -366,7 +436,7 @@ def information_of_sum_log_det_covs(sum_log_det_covs, D):
     return -0.5 * (D + 2) * sum_log_det_covs
 
 
-def predict_information_of_sum_log_det_covs(K, D, data):
+def predict_information_of_sum_log_det_covs(K, D, data, cache=None):
     r"""
     Predict the information content of the sum of the log of the determinant of
     the covariance matrices for a Gaussian mixture model containing :math:`K`
@@ -383,9 +453,15 @@ def predict_information_of_sum_log_det_covs(K, D, data):
         The dimensionality of the data.
 
     :param data:
-        A two-length tuple containing (1) the number of components in previously
-        trialled Gaussian mixtures, and the determinant of the
-        covariance matrices in each mixture.
+        A dictionary containing the number of components in previously trialled
+        Gaussian mixtures, the sum of the log of the determinant of the 
+        covariance matrices of each mixture, and the log of the determinant of
+        the covariance matrices of all mixtures concatenated together.
+
+    :param cache: [optional]
+        A dictionary used to keep the optimised hyperparameters of the Gaussian
+        process between calls. If given, the optimisation starts from the
+        hyperparameters found in the previous call.
 
     :returns:
         A three-length tuple containing:
@@ -406,8 +482,7 @@ def predict_information_of_sum_log_det_covs(K, D, data):
     if data is None:
         raise NotImplementedError("cannot predict this theoretically")
 
-    I_sldc = information_of_sum_log_det_covs(
-        np.array([np.sum(np.log(dc)) for dc in data["det_covs"]]), D)
+    I_sldc = information_of_sum_log_det_covs(data["sum_log_det_covs"], D)
 
     x, y = utils._best_mixture_parameter_values(data["K"], data["I"], I_sldc)
 
@@ -436,17 +511,20 @@ def predict_information_of_sum_log_det_covs(K, D, data):
         gp.set_parameter_vector(p)
         return -gp.grad_log_likelihood(y, quiet=True)
 
-    p0 = gp.get_parameter_vector()
-
-    results = op.minimize(nlp, p0, method="L-BFGS-B")
+    p0, optimised = _initial_parameter_vector(gp, cache, "sum_log_det_covs",
+                                              x, y)
+    if not optimised:
+        results = op.minimize(nlp, p0, jac=grad_nlp, method="L-BFGS-B")
+        p0 = results.x
 
-    gp.set_parameter_vector(results.x)
+    gp.set_parameter_vector(p0)
+    _cache_parameter_vector(gp, cache, "sum_log_det_covs", x, y)
 
     I, I_var = gp.predict(y, K, return_var=True)
 
     # Calculate the lower bound based on the data we have.
-    max_log_det_cov = np.max(np.log(np.hstack(data["det_covs"])))
-    min_log_det_cov = np.min(np.log(np.hstack(data["det_covs"])))
+    max_log_det_cov = np.max(data["slog_det_covs"])
+    min_log_det_cov = np.min(data["slog_det_covs"])
 
 
     I_lower = information_of_sum_log_det_covs(K * min_log_det_cov, D)
@@ -457,7 +535,7 @@ def predict_information_of_sum_log_det_covs(K, D, data):
     return (I, I_var, I_lower, I_upper)
 
 
-def predict_negative_sum_log_likelihood(K, N, D, data):
+def predict_negative_sum_log_likelihood(K, N, D, data, cache=None):
     r"""
     Predict the negative sum of the log likelihood for a Gaussian mixture model
     with :math:`K` components.
@@ -470,6 +548,11 @@ def predict_negative_sum_log_likelihood(K, N, D, data):
         trialled Gaussian mixtures, and (2) the negative sum of the 
         log-likelihood of those Gaussian mixtures.
 
+    :param cache: [optional]
+        A dictionary used to keep the optimised hyperparameters of the Gaussian
+        process between calls. If given, the optimisation starts from the
+        hyperparameters found in the previous call.
+
     :returns:
         A three-length tuple containing:
 
@@ -498,6 +581,10 @@ def predict_negative_sum_log_likelihood(K, N, D, data):
             k = k.flatten()
             return self.c/k + self.a
 
+        def compute_gradient(self, k):
+            k = k.flatten()
+            return np.vstack([1.0/k, np.ones_like(k)])
+
     kernel = var_y * kernels.ExpSquaredKernel(1)#(order=1, log_gamma2=0)
 
     gp = george.GP(kernel=kernel,
@@ -516,11 +603,14 @@ def predict_negative_sum_log_likelihood(K, N, D, data):
 
     gp.compute(x.astype(float), yerr=yerr)
 
-    p0 = gp.get_parameter_vector()
-
-    results = op.minimize(nll, p0, method="L-BFGS-B")
+    p0, optimised = _initial_parameter_vector(gp, cache, 
+                                              "negative_log_likelihood", x, y)
+    if not optimised:
+        results = op.minimize(nll, p0, jac=grad_nll, method="L-BFGS-B")
+        p0 = results.x
 
-    gp.set_parameter_vector(results.x)
+    gp.set_parameter_vector(p0)
+    _cache_parameter_vector(gp, cache, "negative_log_likelihood", x, y)
 
     pred_nll, pred_nll_var = gp.predict(y, K, return_var=True)
 
@@ -530,6 +620,71 @@ def predict_negative_sum_log_likelihood(K, N, D, data):
     return (pred_nll, pred_nll_var, lower)
 
 
+def _initial_parameter_vector(gp, cache, key, x, y):
+    r"""
+    Return the initial hyperparameters to optimise for a Gaussian process.
+
+    Successive predictions only differ by the mixtures trialled since the last
+    call, so the previously optimised hyperparameters are usually a much
+    better starting guess than the defaults. If nothing has been trialled since
+    the last call then they need no further optimisation.
+
+    :param gp:
+        The Gaussian process.
+
+    :param cache:
+        A dictionary of previously optimised hyperparameters, or `None`.
+
+    :param key:
+        The key of the hyperparameters in the `cache`.
+
+    :param x:
+        The inputs that the Gaussian process is conditioned on.
+
+    :param y:
+        The outputs that the Gaussian process is conditioned on.
+
+    :returns:
+        A two-length tuple containing the initial hyperparameters, and a boolean
+        indicating whether they were already optimised for the same `x` and `y`.
+    """
+
+    p0 = gp.get_parameter_vector()
+    if cache is None or key not in cache:
+        return (p0, False)
+
+    cached_x, cached_y, p = cache[key]
+    if p.shape != p0.shape or not np.all(np.isfinite(p)):
+        return (p0, False)
+
+    optimised = np.array_equal(x, cached_x) and np.array_equal(y, cached_y)
+    return (p, optimised)
+
+
+def _cache_parameter_vector(gp, cache, key, x, y):
+    r"""
+    Store the optimised hyperparameters of a Gaussian process in the `cache`.
+
+    :param gp:
+        The Gaussian process.
+
+    :param cache:
+        A dictionary of previously optimised hyperparameters, or `None`.
+
+    :param key:
+        The key of the hyperparameters in the `cache`.
+
+    :param x:
+        The inputs that the Gaussian process is conditioned on.
+
+    :param y:
+        The outputs that the Gaussian process is conditioned on.
+    """
+
+    if cache is not None:
+        cache[key] = (np.copy(x), np.copy(y), gp.get_parameter_vector())
+
+
 def predict_lower_bound_on_negative_log_likelihood(K, N, D, data):
 
     # weights.
@@ -546,7 +701,7 @@ def predict_lower_bound_on_negative_log_likelihood(K, N, D, data):
     I_lower = -N * ((K - 1) * w_a * np.log(w_a) + w_b * np.log(w_b))
 
     # constants
-    I_lower += 0.5 * N * D * np.log(2 * np.pi)
+    I_lower += 0.5 * N * D * _LOG_2PI
 
     # the chi squared distribution has D degrees of freedom AND I DONT KNOW WHY
     # TODO
@@ -556,13 +711,14 @@ def predict_lower_bound_on_negative_log_likelihood(K, N, D, data):
 
 
     # concentration
-    #kt, nll, weights, det_covs = data
+    #kt, nll, weights, slog_det_covs = data
     kt = data["K"]
     weights = data["weights"]
-    det_covs = data["det_covs"]
+    slog_det_covs = data["slog_det_covs"]
 
-    mean_concentration = -0.5 * np.array(
-        [np.sum(w*np.log(dc))/k for k, w, dc in zip(kt, weights, det_covs)])
+    mean_concentration = -0.5 \
+                       * np.add.reduceat(weights * slog_det_covs, data["offsets"]) \
+                       / kt
 
     I_lower += 0.5 * N * K * np.max(mean_concentration)
 
@@ -5,10 +5,8 @@ Operations to apply to gaussian mixtures.
 
 import logging
 import numpy as np
-import scipy
-from sklearn import cluster
-from sklearn.utils import check_random_state
-from sklearn.utils.extmath import row_norms
+import scipy.linalg
+from scipy.special import logsumexp
 
 
 from . import (em, mml, utils)
@@ -18,7 +16,96 @@ logger = logging.getLogger(__name__)
 
 
 
-def kmeans_pp(y, K, random_state=None, **kwargs):
+def kmeans_pp_seeds(y, K, random_state=None, seeds=None):
+    r"""
+    Select the means of :math:`K` components using the K-means++ algorithm.
+    If seeds from a previous call with fewer components are given, then only
+    the additional means are drawn.
+
+    :param y:
+        The data values, :math:`y`, which are expected to have :math:`N` 
+        samples each with :math:`D` dimensions. Expected shape of :math:`y` 
+        is :math:`(N, D)`.
+
+    :param K:
+        The number of Gaussian components in the mixture.
+
+    :param random_state: [optional]
+        The seed, or the `numpy.random.Generator` to draw random numbers from.
+        A generator is used as given, so that it can be shared between calls.
+
+    :param seeds: [optional]
+        The seeds returned by a previous call to this function with fewer than
+        :math:`K` components.
+
+    :returns:
+        A three-length tuple containing:
+
+        (1) the means of the components
+
+        (2) the index of the nearest mean to each data point
+
+        (3) the squared distance from each data point to the nearest mean.
+    """
+
+    rng = np.random.default_rng(random_state)
+    N, D = y.shape
+
+    # Expand the squared distances so that no (N, D) temporary is needed.
+    squared_norms = np.einsum("ij,ij->i", y, y)
+    squared_distance = lambda mean: np.clip(
+        squared_norms - 2 * np.dot(y, mean) + np.dot(mean, mean), 0, None)
+
+    if seeds is None:
+        index = rng.integers(N)
+        previous_means = y[[index]]
+        labels = np.zeros(N, dtype=int)
+        squared_distances = squared_distance(y[index])
+
+    else:
+        previous_means, labels, squared_distances = seeds
+
+    K_previous = previous_means.shape[0]
+    if K_previous > K:
+        raise ValueError(f"seeds have more than {K} components")
+
+    means = np.empty((K, D))
+    means[:K_previous] = previous_means
+
+    # Draw several candidates for each new mean with a probability proportional
+    # to the squared distance from the nearest existing mean, and greedily keep
+    # the candidate that most reduces the sum of those distances. Only the
+    # distances with respect to the new mean are updated.
+    n_local_trials = 2 + int(np.log(K))
+    for k in range(K_previous, K):
+        potential = np.sum(squared_distances)
+        if potential > 0:
+            candidates = np.searchsorted(np.cumsum(squared_distances),
+                                         rng.random(n_local_trials) * potential)
+            np.clip(candidates, None, N - 1, out=candidates)
+
+        else:
+            # Every data point is already at an existing mean (e.g., there are
+            # fewer distinct points than components), so draw uniformly.
+            candidates = rng.integers(N, size=n_local_trials)
+
+        candidate_distances = np.clip(
+            squared_norms - 2 * np.dot(y[candidates], y.T) \
+          + squared_norms[candidates, np.newaxis], 0, None)
+        best = np.argmin(np.sum(
+            np.minimum(candidate_distances, squared_distances), axis=1))
+
+        means[k] = y[candidates[best]]
+
+        distances = candidate_distances[best]
+        closer = distances < squared_distances
+        labels = np.where(closer, k, labels)
+        squared_distances = np.where(closer, distances, squared_distances)
+
+    return (means, labels, squared_distances)
+
+
+def kmeans_pp(y, K, random_state=None, seeds=None, **kwargs):
     r"""
     Initialize a Gaussian mixture model using the K-means++ algorithm.
 
@@ -31,7 +118,11 @@ def kmeans_pp(y, K, random_state=None, **kwargs):
         The number of Gaussian components in the mixture.
     
     :param random_state: [optional]
-        The state to provide to the random number generator.
+        The seed, or the `numpy.random.Generator` to draw random numbers from.
+
+    :param seeds: [optional]
+        The seeds returned by `kmeans_pp_seeds` for this, or fewer than
+        :math:`K` components.
 
     :returns:
         A four-length tuple containing:
@@ -45,22 +136,19 @@ def kmeans_pp(y, K, random_state=None, **kwargs):
         (4) the responsibility matrix for each data point to each component.
     """
 
-    random_state = check_random_state(random_state)
-    squared_norms = row_norms(y, squared=True)
-    means = cluster.k_means_._k_init(y, K,
-                                     random_state=random_state,
-                                     x_squared_norms=squared_norms)
-
-    labels = np.argmin(scipy.spatial.distance.cdist(means, y), axis=0)
+    means, labels, _ = kmeans_pp_seeds(y, K, random_state=random_state,
+                                       seeds=seeds)
 
+    # Each data point belongs to exactly one component, so estimate the
+    # covariance matrices and weights from the labels directly.
     N, D = y.shape
-    responsibilities = np.zeros((K, N))
-    responsibilities[labels, np.arange(N)] = 1.0
-
-    covs = em._estimate_covariance_matrix_full(y, means, responsibilities, 
+    covs = em._estimate_covariance_matrix_full_from_labels(y, means, labels, 
         covariance_regularization=kwargs.get("covariance_regularization", 0))
 
-    weights = responsibilities.sum(axis=1)/N
+    weights = np.bincount(labels, minlength=K)/N
+
+    responsibilities = np.zeros((K, N))
+    responsibilities[labels, np.arange(N)] = 1.0
 
     return (means, covs, weights, responsibilities)
 
@@ -77,7 +165,7 @@ def kmeans_pp_and_em(y, K, random_state=None, **kwargs):
 
 
 def split_component(y, means, covs, weights, responsibilities, index, split=2,
-                    **kwargs):
+                    parent_expectation=None, **kwargs):
     r"""
     Split a component from the current mixture and determine the new optimal
     state.
@@ -106,6 +194,13 @@ def split_component(y, means, covs, weights, responsibilities, index, split=2,
     :param split: [optional]
         The number of components to split the component into. Default to 2, so
         one component will be split into two.
+
+    :param parent_expectation: [optional]
+        The weighted log-probabilities and the log of the determinants of the
+        covariance matrices of the current mixture, as returned by
+        `em._weighted_log_prob`. If given, these are reused for all components
+        that are not split, instead of evaluating the whole perturbed mixture
+        before expectation-maximization starts.
     """
     logger.debug("Splitting component {} of {}".format(index, weights.size))
 
@@ -113,21 +208,24 @@ def split_component(y, means, covs, weights, responsibilities, index, split=2,
     
     # Compute the direction of maximum variance of the parent component, and
     # locate two points which are one standard deviation away on either side.
-    U, S, V = _svd(covs[index], **kwargs)
+    S, V = _leading_eigenpair(covs[index], **kwargs)
 
     # Pick points along the eigenvector.
     sigma_points = np.atleast_2d(np.linspace(-3, 3, 2 + split)[1:-1])
-    projection = np.atleast_2d(V[0] * S[0]**0.5)
+    projection = np.atleast_2d(V * S**0.5)
 
     child_means = means[index] + sigma_points.T @ projection
 
     # Responsibilities are initialized by allocating the data points to the 
-    # closest of the means.
-    # TODO: I'm sure there's a better way to do this.
-    distance = np.vstack([np.sum((y - cmu)**2, axis=1) for cmu in child_means])
-    
+    # closest of the means. The squared norm of each data point is the same
+    # for every child, so only the cross term and the squared norms of the
+    # child means are needed, and no (N, D) temporary is made for each child.
+    distance = np.dot(y, -2 * child_means.T) \
+             + np.einsum("ij,ij->i", child_means, child_means)
+    labels = np.argmin(distance, axis=1)
+
     child_responsibilities = np.zeros((split, N))
-    child_responsibilities[np.argmin(distance, axis=0), np.arange(N)] = 1.0
+    child_responsibilities[labels, np.arange(N)] = 1.0
 
     # Calculate the child covariance matrices.
     child_covs = em._estimate_covariance_matrix(
@@ -164,18 +262,33 @@ def split_component(y, means, covs, weights, responsibilities, index, split=2,
     if K > 1:
 
         # Integrate the K + delta_K components and run expectation-maximization
-        weights = np.hstack([weights, parent_weights * child_weights[1:]])
-        weights[index] = parent_weights * child_weights[0]
+        weights = _replace_with_children(weights, index,
+                                         parent_weights * child_weights)
 
-        responsibilities = np.vstack([responsibilities, 
-            parent_responsibilities * child_responsibilities[1:]])
-        responsibilities[index] = parent_responsibilities * child_responsibilities[0]
-        
-        means = np.vstack([means, child_means[1:]])
-        means[index] = child_means[0]
+        child_responsibilities *= parent_responsibilities
+        responsibilities = _replace_with_children(responsibilities, index,
+                                                  child_responsibilities)
+
+        means = _replace_with_children(means, index, child_means)
+        covs = _replace_with_children(covs, index, child_covs)
+
+        if parent_expectation is not None:
+            # Only the child components need to be evaluated.
+            log_prob, slogdetcovs = parent_expectation
+            child_log_prob, child_slogdetcovs = em._weighted_log_prob(
+                y, child_means, child_covs, parent_weights * child_weights,
+                **kwargs)
+
+            log_prob = np.hstack([log_prob, child_log_prob[:, 1:]])
+            log_prob[:, index] = child_log_prob[:, 0]
+            slogdetcovs = _replace_with_children(slogdetcovs, index,
+                                                 child_slogdetcovs)
 
-        covs = np.vstack([covs, child_covs[1:]])
-        covs[index] = child_covs[0]
+            ll = logsumexp(log_prob, axis=1)
+            I = mml.gaussian_mixture_message_length(weights.size, N, D,
+                np.sum(ll), np.sum(slogdetcovs), [weights])
+
+            kwargs.update(initial_expectation=(responsibilities, ll, I))
 
         state, responsibilities, ll, I = em.expectation_maximization(
             y, means, covs, weights, 
@@ -193,6 +306,33 @@ def split_component(y, means, covs, weights, responsibilities, index, split=2,
     return (state, responsibilities, ll, I)
 
 
+def _replace_with_children(values, index, children):
+    r"""
+    Return a copy of the per-component values of a mixture, where the values
+    of the component at `index` are replaced by those of the first child, and
+    the values of the other children are appended at the end. The copy is
+    allocated once and filled in place.
+
+    :param values:
+        The values of each of the :math:`K` components (e.g., the means).
+
+    :param index:
+        The index of the component that was split.
+
+    :param children:
+        The values of each child component.
+    """
+
+    K, C = (values.shape[0], children.shape[0])
+
+    replaced = np.empty((K + C - 1, *values.shape[1:]),
+                        dtype=np.result_type(values, children))
+    replaced[:K] = values
+    replaced[K:] = children[1:]
+    replaced[index] = children[0]
+    return replaced
+
+
 def delete_component(y, means, covs, weights, responsibilities, index, **kwargs):
     r"""
     Delete a component from the mixture, and return the new optimal state.
@@ -220,29 +360,42 @@ def delete_component(y, means, covs, weights, responsibilities, index, **kwargs)
     """
     logger.debug(f"Deleting component {index} of {weights.size}")
 
+    # Build the mask of remaining components once. Indexing with it copies,
+    # so the arrays of the given mixture (which may be shared between
+    # perturbations) are not modified, and the copies are updated in place.
+    keep = np.arange(weights.size) != index
+
     # Create new component weights.
     parent_weights = weights[index]
     parent_responsibilities = responsibilities[index]
     
     # Eq. 54-55
-    weights_ = np.clip(
-        np.delete(weights, index, axis=0)/(1 - parent_weights),
-        0, 1)
+    weights_ = weights[keep]
+    weights_ /= 1 - parent_weights
+    np.clip(weights_, 0, 1, out=weights_)
     
-    # Calculate the new responsibility safely.
-    responsibilities_ = np.clip(np.delete(responsibilities, index, axis=0) \
-                             / (1 - parent_responsibilities), 0, 1)
-    responsibilities_[~np.isfinite(responsibilities_)] = 0.0
-
-    means_ = np.delete(means, index, axis=0)
-    covs_ = np.delete(covs, index, axis=0)
+    # Calculate the new responsibility safely. The reciprocal is only taken
+    # once per data point, and points that belonged entirely to the deleted
+    # component are given zero responsibility. Unlike a clip, fmax also maps
+    # any undefined (NaN) responsibilities to zero in the same pass.
+    inv = np.reciprocal(1 - parent_responsibilities,
+                        where=(parent_responsibilities < 1),
+                        out=np.zeros_like(parent_responsibilities))
+    responsibilities_ = responsibilities[keep]
+    responsibilities_ *= inv
+    np.fmax(responsibilities_, 0, out=responsibilities_)
+    np.fmin(responsibilities_, 1, out=responsibilities_)
+
+    means_ = means[keep]
+    covs_ = covs[keep]
 
     # Run expectation-maximizaton on the perturbed mixtures. 
     return em.expectation_maximization(
         y, means_, covs_, weights_, responsibilities=responsibilities_, **kwargs)
 
 
-def merge_component(y, means, covs, weights, responsibilities, index, **kwargs):
+def merge_component(y, means, covs, weights, responsibilities, index,
+                    nearest=None, **kwargs):
     r"""
     Merge a component from the mixture with its "closest" component, as
     judged by the Kullback-Leibler distance.
@@ -267,16 +420,22 @@ def merge_component(y, means, covs, weights, responsibilities, index, **kwargs):
 
     :param index:
         The index of the component to be merged.
+
+    :param nearest: [optional]
+        The index of the closest component to every component in the mixture.
+        If given, the Kullback-Leibler distances are not calculated again.
     """
 
-    # Calculate the Kullback-Leibler distance to the other distributions.
-    D_kl = np.inf * np.ones(weights.size)
-    for k in range(weights.size):
-        if k == index: continue
-        D_kl[k] = utils.kullback_leibler_for_multivariate_normals(
-            means[index], covs[index], means[k], covs[k])
+    if nearest is None:
+        # Calculate the Kullback-Leibler distance to the other distributions.
+        D_kl = utils.kullback_leibler_for_multivariate_normals(
+            means[index], covs[index], means, covs)
+        D_kl[index] = np.inf
+
+        a_index, b_index = (index, np.nanargmin(D_kl))
 
-    a_index, b_index = (index, np.nanargmin(D_kl))
+    else:
+        a_index, b_index = (index, nearest[index])
 
     K = weights.size
     logger.debug(f"Merging component {a_index} (of {K}) with {b_index}")
@@ -287,20 +446,20 @@ def merge_component(y, means, covs, weights, responsibilities, index, **kwargs):
         np.sum(responsibilities[[a_index, b_index]], axis=0))
     effective_membership_k = np.sum(responsibilities_k)
 
-    means_k = np.atleast_2d(
-        np.sum(responsibilities_k * y.T, axis=1) / effective_membership_k)
+    means_k = np.dot(responsibilities_k, y) / effective_membership_k
 
     covs_k = em._estimate_covariance_matrix(
         y, means_k, responsibilities_k, **kwargs)
 
     # Delete the b-th component.
-    del_index = np.max([a_index, b_index])
-    keep_index = np.min([a_index, b_index])
+    del_index = max(a_index, b_index)
+    keep_index = min(a_index, b_index)
 
-    means_ = np.delete(means, del_index, axis=0)
-    covs_ = np.delete(covs, del_index, axis=0)
-    weights_ = np.delete(weights, del_index, axis=0)
-    responsibilities_ = np.delete(responsibilities, del_index, axis=0)
+    keep = np.arange(K) != del_index
+    means_ = means[keep]
+    covs_ = covs[keep]
+    weights_ = weights[keep]
+    responsibilities_ = responsibilities[keep]
 
     means_[keep_index] = means_k
     covs_[keep_index] = covs_k
@@ -311,13 +470,34 @@ def merge_component(y, means, covs, weights, responsibilities, index, **kwargs):
         y, means_, covs_, weights_, responsibilities=responsibilities_, **kwargs)
 
 
-def _svd(covariance, covariance_type, **kwargs):
+def _leading_eigenpair(covariance, covariance_type, **kwargs):
+    r"""
+    Return the largest eigenvalue of a covariance matrix and its eigenvector,
+    which give the direction and the amount of maximum variance.
+
+    :param covariance:
+        The covariance matrix, or its diagonal if `covariance_type` is "diag".
+
+    :param covariance_type:
+        The structure of the covariance matrix.
+
+    :returns:
+        A two-length tuple containing the largest eigenvalue and the
+        corresponding unit eigenvector.
+    """
 
     if covariance_type == "full":
-        return np.linalg.svd(covariance)
+        # Only the leading eigenpair of the symmetric matrix is computed.
+        D = covariance.shape[0]
+        S, V = scipy.linalg.eigh(covariance, subset_by_index=[D - 1, D - 1])
+        return (S[0], V[:, 0])
 
     elif covariance_type == "diag":
-        return np.linalg.svd(covariance * np.eye(covariance.size))
+        # The eigenvectors of a diagonal matrix are the coordinate axes.
+        index = np.argmax(covariance)
+        V = np.zeros(covariance.size)
+        V[index] = 1
+        return (covariance[index], V)
 
     else:
         raise ValueError("unknown covariance type")
@@ -339,7 +519,9 @@ def preferred_mixture_index(K, previous_K):
     return idx[0]
 
 
-def iteratively_remove_components(y, means, covs, weights, K, **kwargs):
+def iteratively_remove_components(y, means, covs, weights, K,
+                                  responsibilities=None, log_likelihoods=None,
+                                  **kwargs):
     r"""
     Iteratively remove components in a mixture until we reach a target
     distribution of :math:`K` Gaussian components.
@@ -360,33 +542,47 @@ def iteratively_remove_components(y, means, covs, weights, K, **kwargs):
 
     :param K:
         The number of target Gaussian components.
+
+    :param responsibilities: [optional]
+        The responsibility matrix of the given mixture, if it is already known.
+
+    :param log_likelihoods: [optional]
+        The log-likelihood of each observation under the given mixture, if it
+        is already known. The expectation step on the given mixture is skipped
+        if this and the responsibility matrix are given.
     """
 
     if weights.size <= K:
         raise ValueError(f"the given mixture already has <={K} components")
 
-    Ks = []
-    Is = []
+    ll = log_likelihoods
     while K < weights.size:
 
-        # Delete the component with the largest message length.
-        R, ll, I_components = em._component_expectations(y, means, covs, weights,
-                                                         **kwargs)
-        index = np.argsort(I_components)[-1]
+        # Delete the component with the largest message length. After the 
+        # first merge, the expectation of the current mixture is already
+        # known from the last expectation-maximization step.
+        if responsibilities is None or ll is None:
+            responsibilities, ll, I_components = em._component_expectations(
+                y, means, covs, weights, **kwargs)
+
+        else:
+            I_components = mml.gmm_component_contributions_to_message_length(
+                responsibilities, ll, covs, weights)
+
+        index = np.argmax(I_components)
         
         (means, covs, weights), responsibilities, ll, I = merge_component(
-            y, means, covs, weights, R, index, **kwargs)
-
-        print("Current state is (K = {}; I = {})".format(
-            weights.size, np.sum(np.hstack(I.values()))))
+            y, means, covs, weights, responsibilities, index, **kwargs)
 
-        Ks.append(weights.size)
-        Is.append(np.sum(np.hstack(I.values())))
+        logger.debug("Current state is (K = {}; I = {})".format(
+            weights.size, mml.total_message_length(I)))
 
     return (means, covs, weights, responsibilities, ll, I)
 
 
-def iteratively_split_components(y, means, covs, weights, K, **kwargs):
+def iteratively_split_components(y, means, covs, weights, K,
+                                 responsibilities=None, log_likelihoods=None,
+                                 **kwargs):
     r"""
     Iteratively split and refine a mixture until we reach a target distribution
     of :math:`K` Gaussian components.
@@ -407,6 +603,14 @@ def iteratively_split_components(y, means, covs, weights, K, **kwargs):
 
     :param K:
         The number of target Gaussian components.
+
+    :param responsibilities: [optional]
+        The responsibility matrix of the given mixture, if it is already known.
+
+    :param log_likelihoods: [optional]
+        The log-likelihood of each observation under the given mixture, if it
+        is already known. The expectation step on the given mixture is skipped
+        if this and the responsibility matrix are given.
     """
 
     if weights.size >= K:
@@ -415,36 +619,31 @@ def iteratively_split_components(y, means, covs, weights, K, **kwargs):
 
     meta = dict(I_components_chosen_for_split=[])
 
-    Ks = []
-    Is = []
+    ll = log_likelihoods
     while K > weights.size:
 
-        # Split the component with the largest message length.
-        R, ll, I_components = em._component_expectations(y, means, covs, weights, 
-                                                         **kwargs)
-        index = np.argsort(I_components)[-1]
-        
-        # TODO: Allow us to get back the component-wise relative message lengths
-        #       so we don't have to calculate the expectation step twice.
+        # Split the component with the largest message length. After the
+        # first split, the expectation of the current mixture is already
+        # known from the last expectation-maximization step.
+        if responsibilities is None or ll is None:
+            responsibilities, ll, I_components = em._component_expectations(
+                y, means, covs, weights, **kwargs)
+
+        else:
+            I_components = mml.gmm_component_contributions_to_message_length(
+                responsibilities, ll, covs, weights)
+
+        index = np.argmax(I_components)
 
         meta["I_components_chosen_for_split"].append([I_components[index], np.sum(I_components)])
 
         (state, responsibilities, ll, I) = split_component(
-            y, means, covs, weights, R, index, **kwargs)
+            y, means, covs, weights, responsibilities, index, **kwargs)
 
         means, covs, weights = state
 
-
-        Ks.append(weights.size)
-        Is.append(np.sum(np.hstack(I.values())))
-
-        print("Current state (K = {}; I = {})".format(Ks[-1], Is[-1]))
-
-    """
-    import matplotlib.pyplot as plt
-    fig, ax = plt.subplots()
-    ax.scatter(Ks, Is)
-    """
+        logger.debug("Current state is (K = {}; I = {})".format(
+            weights.size, mml.total_message_length(I)))
 
     debug = kwargs.get("debug", False)
 
@@ -470,39 +669,11 @@ def simultaneously_split_mixture(y, means, covs, weights, K, **kwargs):
 
 
     else:
-        """
-        # Approximate something like min(I_components), while ensuring that we
-        # will meet the required constraint.
-
-        # TODO: This strategy is ad-hoc and probably wrong.
-        #       If anything, it should be better explained.
-        alpha = np.sum(I_components)/(new_K + K)
-
-        K_available = np.ceil(I_components/alpha).astype(int) - 1
-
-        # Need an array of components to split, and how much we should split them.
-        N_splits = np.sum(K_available > 0)
-
-        indices = np.zeros(N_splits, dtype=int)
-        splits = np.zeros(N_splits, dtype=int)
-        idxs = np.argsort(I_components)[::-1]
-
-        for i, index in enumerate(idxs[:N_splits]):
-            indices[i] = index
-            splits[i] = min(K_available[index], new_K - np.sum(splits))
-
-        assert sum(splits) >= new_K
-        if sum(splits) > new_K:
-            raise a
-
-        state = (means, covs, weights)
-        for index, split in zip(indices, splits):
-            state, R, ll, I = split_component(y, *state, R, index, 1 + split,
-                                              **kwargs)
-        """
-
-        # Split the top K_new in half.
-        idx = np.argsort(I_components)[::-1][:K_new]
+        # Split the top K_new in half, starting with the largest contribution.
+        # Only the top K_new need to be ordered, not all components.
+        n = min(K_new, I_components.size)
+        idx = np.argpartition(I_components, -n)[-n:]
+        idx = idx[np.argsort(I_components[idx])[::-1]]
 
         indices = np.zeros(K_new, dtype=int)
         splits = np.zeros(K_new, dtype=int)
@@ -2,6 +2,7 @@
 import logging
 import numpy as np
 from .base import Policy
+from .. import mml
 
 logger_name, *_ = __name__.split(".")
 logger = logging.getLogger(logger_name)
@@ -82,7 +83,7 @@ class ConvergedWithSuccessivelyWorseIterations(BaseConvergencePolicy):
         if T < N:
             return False
 
-        ml = lambda I: I if isinstance(I, float) else np.sum(np.hstack(I.values()))
+        ml = lambda I: I if isinstance(I, float) else mml.total_message_length(I)
 
         # Check to see if the last X iterations were worse.
         K = np.hstack(self.model._results.keys())[-N:]
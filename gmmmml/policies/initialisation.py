@@ -5,6 +5,8 @@ Policies for prediction and search.
 
 import logging
 import numpy as np
+from itertools import chain, repeat
+from joblib import Parallel, delayed
 
 from .base import Policy
 from .. import operations as op
@@ -31,7 +33,7 @@ class BaseInitialisationPolicy(Policy):
 
 class DefaultInitialisationPolicy(BaseInitialisationPolicy):
 
-    def initialise(self, y, **kwargs):
+    def initialise(self, y, n_jobs=1, **kwargs):
 
         y = np.atleast_2d(y)
         N, D = y.shape
@@ -41,17 +43,73 @@ class DefaultInitialisationPolicy(BaseInitialisationPolicy):
         if not np.all(np.isfinite(y)):
             raise ValueError("not all Y values finite")
 
-        for i, K in enumerate(K_inits):
-
+        # The K_inits are increasing, so the K-means++ seeds from the previous
+        # mixture can be extended rather than drawn again from one generator.
+        rng = np.random.default_rng(kwargs.get("random_state", None))
+
+        def _initialise(K, seeds, **kwds):
+            *state, R = op.kmeans_pp(y, K, seeds=seeds, **kwds)
+            return self.model.expectation_maximization(y, *state, **kwds)
+
+        if n_jobs == 1:
+            seeds = None
+            for K in K_inits:
+                try:
+                    seeds = op.kmeans_pp_seeds(y, K, random_state=rng,
+                                               seeds=seeds)
+                    result = _initialise(K, seeds, **kwargs)
+
+                except ValueError:
+                    logger.warning(f"Failed to initialise at K = {K}")
+                    break
+
+                yield (K, result)
+
+            return None
+
+        # Each initialisation is independent, so run expectation-maximization
+        # on them in parallel. Threads are used because the model records the
+        # state of each mixture. The states are recorded in order as the runs
+        # finish, so that no mixture after the first failed initialisation is
+        # recorded. Runs after a failure are not started, but runs that have
+        # already started are finished and then discarded.
+        callback = kwargs.get("__callback_function", None)
+        kwds = {**kwargs, "__callback_function": None}
+
+        seeds = []
+        for K in K_inits:
             try:
-                *state, R = op.kmeans_pp(y, K, **kwargs)
-                yield (K, self.model.expectation_maximization(y, *state, **kwargs))
+                seeds.append(op.kmeans_pp_seeds(y, K, random_state=rng,
+                                                seeds=seeds[-1] if seeds else None))
 
             except ValueError:
-                logger.warn(f"Failed to initialise at K = {K}")
                 break
 
-        return None
+        failures = []
+        def _try_initialise(K, K_seeds):
+            if failures and K > min(failures):
+                return None
+
+            try:
+                return _initialise(K, K_seeds, **kwds)
+
+            except ValueError:
+                failures.append(K)
+                return None
+
+        results = Parallel(n_jobs=n_jobs, prefer="threads",
+                           return_as="generator")(
+            delayed(_try_initialise)(K, K_seeds) \
+            for K, K_seeds in zip(K_inits, seeds))
 
+        for K, result in zip(K_inits, chain(results, repeat(None))):
+            if result is None:
+                logger.warning(f"Failed to initialise at K = {K}")
+                break
 
+            if callback is not None:
+                callback(*result)
 
+            yield (K, result)
+
+        return None
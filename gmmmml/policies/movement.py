@@ -1,19 +1,54 @@
 
 import logging
 import numpy as np
-from scipy.special import erf
+from scipy.special import (erfcx, ndtr)
 from scipy.signal import find_peaks_cwt
 from .base import Policy
 
 logger_name, *_ = __name__.split(".")
 logger = logging.getLogger(logger_name)
 
+_LOG_2PI = np.log(2 * np.pi)
+_SQRT_2 = np.sqrt(2)
+_SQRT_PI_ON_2 = np.sqrt(np.pi / 2)
+
 
 class BaseMovementPolicy(Policy):
     pass
 
 
 
+def _log_expected_improvement(I_diff, I_var):
+    r"""
+    Return the log of the expected improvement in message length.
+
+    The expected improvement underflows to zero far below the current minimum,
+    which leaves nothing to rank those mixtures by. In that tail the log of
+    the expected improvement is evaluated through the scaled complementary
+    error function instead, so it never needs to be exponentiated.
+
+    :param I_diff:
+        The difference between the minimum message length found so far and the
+        predicted message lengths.
+
+    :param I_var:
+        The variance on the predicted message lengths.
+    """
+
+    sigma = np.sqrt(I_var)
+    chi = I_diff / sigma
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        log_phi = -0.5 * (chi**2 + _LOG_2PI)
+        log_h = np.where(chi > -1,
+            np.log(chi * ndtr(chi) + np.exp(log_phi)),
+            log_phi + np.log1p(chi * _SQRT_PI_ON_2 * erfcx(-chi/_SQRT_2)))
+
+    return np.log(sigma) + log_h
+
+
+
+
 class JumpToMMLMixtureMovementPolicy(BaseMovementPolicy):
 
     def move(self, y, **kwargs):
@@ -44,16 +79,18 @@ class JumpToMMLMixtureMovementPolicy(BaseMovementPolicy):
             _, __ = np.unique(K_nexts, return_index=True)
             K_nexts = K_nexts[np.sort(__)]
 
-            for K in K_nexts:
-                if K not in self.model._state_K and K not in self.model._results \
-                and K not in K_failures: break
+            # Take the first K that has not been trialled.
+            K_nexts = K_nexts[~np.isin(K_nexts, np.hstack([
+                self.model._state_K, [*self.model._results], K_failures]))]
 
-            else:
+            if not K_nexts.size:
                 # No predictions!
                 logger.warn("MovementPolicy has no new places to move to. "\
                             "Convergence may not be reached.")
                 break
 
+            K = K_nexts[0]
+
             logger.info(f"Moving to K = {K}")
             yield K
 
@@ -78,13 +115,9 @@ class ConvergeToMixtureWithMaximumExpectationImprovementPolicy(BaseMovementPolic
             # between predictions, otherwise the policy will *always* want to
             # expand the bounds of K (rather than finding K minimum).
 
-            # Calculate the acquisition function.
+            # Calculate the acquisition function in log space.
             I_min = np.min(self.model._state_I)
-            I_diff = I_min - I
-            chi = I_diff / np.sqrt(I_var)
-            Phi = 0.5 * (1.0 + erf(chi / np.sqrt(2)))
-            phi = np.exp(-0.5 * chi**2) / np.sqrt(2 * np.pi * I_var)
-            A_ei = I_diff * Phi + I_var * phi
+            A_ei = _log_expected_improvement(I_min - I, I_var)
 
             # Prefer the point that maximizes the expectation improvement.
             indices = [np.argmax(A_ei)]
@@ -94,12 +127,12 @@ class ConvergeToMixtureWithMaximumExpectationImprovementPolicy(BaseMovementPolic
 
             # Unique without sorting.
             sidx = np.unique(indices, return_index=True)[1]
-            indices = np.array([indices[si] for si in sorted(sidx)])
+            indices = indices[np.sort(sidx)]
 
             # Next values to try, excluding trialled.
-            K_next = [Kp[i] for i in indices \
-                if  Kp[i] not in self.model._results.keys() \
-                and Kp[i] not in self.model._state_K]
+            K_next = Kp[indices]
+            K_next = K_next[~np.isin(K_next, np.hstack([
+                [*self.model._results], self.model._state_K]))]
 
             # OK, take best.
             if len(K_next) == 0:
@@ -176,7 +209,7 @@ class IncreasingComponentsPolicy(BaseMovementPolicy):
     def move(self, y, **kwargs):
 
         while not self.converged:
-            if self.model._state_K:
+            if self.model._state_K.size:
                 K_max = np.max(self.model._state_K)
                 yield 1 + K_max
             else:
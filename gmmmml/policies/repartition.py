@@ -2,11 +2,12 @@
 
 import logging
 import numpy as np
-from collections import defaultdict
+from functools import partial
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 from .base import Policy
-from .. import (em, operations as op)
+from .. import (em, mml, operations as op, utils)
 
 logger_name, *_ = __name__.split(".")
 logger = logging.getLogger(logger_name)
@@ -28,7 +29,8 @@ class IterativelyRepartitionFromNearestMixturePolicy(BaseRepartitionPolicy):
 
         # Get nearest mixture.
         state, R, ll, I = _nearest_mixture(self.model._results, K)
-        return (K, op.iteratively_operate_on_components(y, *state, K, **kwargs))
+        return (K, op.iteratively_operate_on_components(
+            y, *state, K, responsibilities=R, log_likelihoods=ll, **kwargs))
 
 
 class RepartitionMixtureUsingKMeansPP(BaseRepartitionPolicy):
@@ -61,7 +63,8 @@ class SimultaneousRepartitionFromNearestMixturePolicy(BaseRepartitionPolicy):
 class GreedilyPerturbNearestMixturePolicy(BaseRepartitionPolicy):
 
 
-    def repartition(self, y, K=None, **kwargs):
+    def repartition(self, y, K=None, n_jobs=1, max_split_candidates=None,
+                    **kwargs):
 
         # Get nearest (or most recent) mixture.
         if K is None:
@@ -72,41 +75,41 @@ class GreedilyPerturbNearestMixturePolicy(BaseRepartitionPolicy):
             state, R, ll, prev_I = _nearest_mixture(self.model._results, K)
             K = _K_from_state(state)
 
-        # Exhaustively try all perturbations.
-        best_perturbations = defaultdict(lambda: [np.inf])
-
         # TODO: Prevent things gonig into _results unless we have the full dictionary of message lengths
-        ml = lambda I: np.sum(np.hstack(I.values()))
+        ml = mml.total_message_length
 
         tqdm_format = lambda f: None if kwargs.get("quiet", False) else f
 
-        # Exhaustively split all components.
-        for k in tqdm(range(K), desc=tqdm_format(f"Splitting K={K}")):
-            p = op.split_component(y, *state, R, k, **kwargs)
-            
-            # Keep best split component.
-            I = ml(p[-1])
-            if I < best_perturbations["split"][0]:
-                best_perturbations["split"] = [I, k] + list(p)
+        # The components that are not split are the same for every split, so
+        # evaluate them once.
+        try:
+            parent_expectation = em._weighted_log_prob(y, *state, **kwargs)
 
+        except ValueError:
+            parent_expectation = None
+
+        # Exhaustively split, delete, and merge all components. The nearest
+        # component to each component is found once for all merges. Merging
+        # two components that are each other's nearest neighbour gives the same
+        # mixture either way, so each pair is only merged once.
+        operations = dict(split=partial(op.split_component,
+                                        parent_expectation=parent_expectation))
+        candidates = dict()
         if K > 1:
-            # Exhaustively delete all components.
-            for k in tqdm(range(K), desc=tqdm_format(f"Deleting K={K}")):
-                p = op.delete_component(y, *state, R, k, **kwargs)
-                
-                # Keep best delete component.
-                I = ml(p[-1])
-                if I < best_perturbations["delete"][0]:
-                    best_perturbations["delete"] = [I, k] + list(p)
-
-            # Exhaustively merge all components.
-            for k in tqdm(range(K), desc=tqdm_format(f"Merging K={K}")):
-                p = op.merge_component(y, *state, R, k, **kwargs)
-                
-                # Keep best merged component.
-                I = ml(p[-1])
-                if I < best_perturbations["merge"][0]:
-                    best_perturbations["merge"] = [I, k] + list(p)
+            nearest = _nearest_components(state)
+            operations.update(delete=op.delete_component,
+                              merge=partial(op.merge_component,
+                                            nearest=nearest))
+            candidates.update(merge=_merge_candidates(nearest))
+
+        # Optionally only split the components that are most likely to need it.
+        if max_split_candidates is not None:
+            candidates.update(split=_split_candidates(
+                state, max_split_candidates))
+
+        best_perturbations = _best_perturbations(
+            operations, y, state, R, K, n_jobs=n_jobs, candidates=candidates,
+            desc=tqdm_format(f"Perturbing K={K}"), **kwargs)
 
 
         bop, bp = min(best_perturbations.items(), key=lambda x: x[1][0])
@@ -122,7 +125,10 @@ class GreedilyPerturbNearestMixturePolicy(BaseRepartitionPolicy):
 
 
         if debug:
-            _, __, I_components = em._component_expectations(y, *state, **kwargs)
+            # The responsibilities and log-likelihoods of the unperturbed
+            # mixture are already known, so the expectation step is not redone.
+            I_components = mml.gmm_component_contributions_to_message_length(
+                R, ll, *state[1:])
             meta = dict(I_component_chosen=np.hstack([I_components[bp[1]], I_components]),
                         operation=bop)
 
@@ -136,6 +142,150 @@ class GreedilyPerturbNearestMixturePolicy(BaseRepartitionPolicy):
 
 
 
+def _best_perturbations(operations, y, state, R, K, n_jobs=1, candidates=None,
+                        desc=None, **kwargs):
+    r"""
+    Apply each perturbation to every component of a mixture and return the
+    best result of each perturbation.
+
+    All perturbations are independent, so they are run together in parallel.
+    Threads are used because the model records the state of each mixture as it
+    goes. Threads only make this faster when the linear algebra (BLAS) dominates
+    the cost, as for large mixtures or many dimensions; otherwise the Python in
+    expectation-maximization holds the interpreter lock and the perturbations
+    run no faster than in serial.
+
+    :param operations:
+        A dictionary of the perturbations to apply, where each value is a
+        callable (e.g., `operations.split_component`).
+
+    :param y:
+        The data values.
+
+    :param state:
+        A three-length tuple containing the means, covariance matrices, and
+        relative weights of the mixture to perturb.
+
+    :param R:
+        The responsibility matrix of the mixture.
+
+    :param K:
+        The number of components in the mixture.
+
+    :param n_jobs: [optional]
+        The number of perturbations to run at once (default: 1).
+
+    :param candidates: [optional]
+        A dictionary containing the indices of the components to perturb for
+        some operations. Operations that are not in this dictionary are
+        applied to every component.
+
+    :param desc: [optional]
+        A description for the progress bar. If `None` is given, no description
+        is shown.
+
+    :returns:
+        A dictionary with the same keys as `operations`, where each value is a
+        list containing the message length of the best perturbation, the index
+        of the component that was perturbed, and the output of the
+        perturbation. If no perturbation has a finite message length then the
+        list only contains `np.inf`.
+    """
+
+    candidates = candidates or dict()
+    trials = [(name, k) for name in operations \
+                        for k in candidates.get(name, range(K))]
+
+    # Update the progress bar as perturbations finish, not as they are sent.
+    perturbations = Parallel(n_jobs=n_jobs, prefer="threads",
+                             return_as="generator")(
+        delayed(operations[name])(y, *state, R, k, **kwargs) \
+        for name, k in trials)
+
+    best = {name: [np.inf] for name in operations}
+    for (name, k), p in zip(trials, tqdm(perturbations, total=len(trials),
+                                         desc=desc)):
+        I = mml.total_message_length(p[-1])
+        if I < best[name][0]:
+            best[name] = [I, k] + list(p)
+
+    return best
+
+
+def _split_candidates(state, T):
+    r"""
+    Return the indices of the components that are the best candidates to split,
+    ranked by the log of the product of their weight and the square root of
+    the determinant of their covariance matrix. The ranking increases with
+    both the weight and the volume of a component, whatever the units of the
+    data.
+
+    :param state:
+        A three-length tuple containing the means, covariance matrices, and
+        relative weights of the mixture.
+
+    :param T:
+        The maximum number of candidates to return.
+
+    :returns:
+        An array of at most `T` component indices.
+    """
+
+    means, covs, weights = state
+    if covs.ndim == 3:
+        _, logdet = np.linalg.slogdet(covs)
+    else:
+        logdet = np.sum(np.log(covs), axis=1)
+
+    score = np.log(weights) + 0.5 * logdet
+    T = min(int(T), score.size)
+    indices = np.argpartition(score, -T)[-T:]
+    return indices[np.argsort(score[indices])[::-1]]
+
+
+def _nearest_components(state):
+    r"""
+    Return the index of the closest component to every component of a mixture,
+    as judged by the Kullback-Leibler distance.
+
+    :param state:
+        A three-length tuple containing the means, covariance matrices, and
+        relative weights of the mixture.
+
+    :returns:
+        An array of component indices.
+    """
+
+    means, covs, weights = state
+
+    D_kl = utils._pairwise_kullback_leibler_for_multivariate_normals(
+        means, covs)
+    np.fill_diagonal(D_kl, np.inf)
+    return np.nanargmin(D_kl, axis=1)
+
+
+def _merge_candidates(nearest):
+    r"""
+    Return the indices of the components to merge with their nearest component,
+    such that each pair of components is only merged once.
+
+    :param nearest:
+        The index of the closest component to every component in the mixture.
+
+    :returns:
+        A list of component indices.
+    """
+
+    pairs, candidates = (set(), [])
+    for index, partner in enumerate(nearest):
+        pair = tuple(sorted((index, partner)))
+        if pair not in pairs:
+            pairs.add(pair)
+            candidates.append(index)
+
+    return candidates
+
+
 def _K_from_state(state):
     return len(state[-1])
 
@@ -1,10 +1,8 @@
 
 import numpy as np
+from scipy.linalg import solve_triangular
 from scipy.special import beta
 
-from sklearn import datasets
-from sklearn.neighbors import NearestNeighbors
-
 
 
 def kullback_leibler_for_multivariate_normals(mu_a, cov_a, mu_b, cov_b):
@@ -34,10 +32,13 @@ def kullback_leibler_for_multivariate_normals(mu_a, cov_a, mu_b, cov_b):
         The covariance matrix of the first multivariate normal distribution.
 
     :param mu_b:
-        The mean of the second multivariate normal distribution.
+        The mean of the second multivariate normal distribution. This can also
+        be a :math:`(K, D)` array of the means of :math:`K` distributions, in
+        which case the distance to each of them is returned.
         
     :param cov_b:
-        The covariance matrix of the second multivariate normal distribution.
+        The covariance matrix of the second multivariate normal distribution,
+        or the covariance matrices of :math:`K` distributions.
     
     :returns:
         The Kullback-Leibler distance from distribution :math:`a` to :math:`b`
@@ -45,65 +46,152 @@ def kullback_leibler_for_multivariate_normals(mu_a, cov_a, mu_b, cov_b):
         the distance in units of bits.
     """
 
-    if len(cov_a.shape) == 1:
-        cov_a = cov_a * np.eye(cov_a.size)
+    if np.ndim(mu_b) == 2:
+        return _kullback_leibler_for_many_multivariate_normals(
+            mu_a, cov_a, mu_b, cov_b)
+
+    if cov_a.ndim == 1 and cov_b.ndim == 1:
+        # Diagonal covariance matrices need no matrices or factorisations.
+        offset = mu_b - mu_a
+        return 0.5 * np.sum(
+            (cov_a + offset**2)/cov_b - 1 + np.log(cov_b) - np.log(cov_a))
 
-    if len(cov_b.shape) == 1:
-        cov_b = cov_b * np.eye(cov_b.size)
+    if cov_a.ndim == 1:
+        cov_a = np.diag(cov_a)
 
-    U, S, V = np.linalg.svd(cov_a)
-    Ca_inv = np.dot(np.dot(V.T, np.linalg.inv(np.diag(S))), U.T)
+    if cov_b.ndim == 1:
+        cov_b = np.diag(cov_b)
 
-    U, S, V = np.linalg.svd(cov_b)
-    Cb_inv = np.dot(np.dot(V.T, np.linalg.inv(np.diag(S))), U.T)
+    # Every term can be evaluated with triangular solves against the Cholesky
+    # factors, without forming either inverse explicitly. The trace and the
+    # Mahalanobis terms share one solve by stacking the right-hand sides.
+    L_a = np.linalg.cholesky(cov_a)
+    L_b = np.linalg.cholesky(cov_b)
 
     k = mu_a.size
 
     offset = mu_b - mu_a
-    return 0.5 * np.sum([
-          np.trace(np.dot(Ca_inv, cov_b)),
-        + np.dot(offset.T, np.dot(Cb_inv, offset)),
-        - k,
-        + np.log(np.linalg.det(cov_b)/np.linalg.det(cov_a))
-    ])
+    Z = solve_triangular(L_b, np.column_stack([L_a, offset]), lower=True,
+                         check_finite=False)
+    trace = np.sum(Z[:, :k]**2)
+    mahalanobis = np.sum(Z[:, k]**2)
+    log_det_ratio = 2 * np.sum(np.log(np.diag(L_b)) - np.log(np.diag(L_a)))
 
+    return 0.5 * (trace + mahalanobis - k + log_det_ratio)
 
 
-def _best_mixture_parameter_values(K, I, value):
+def _kullback_leibler_for_many_multivariate_normals(mu_a, cov_a, mu_b, cov_b):
+    r"""
+    Return the Kullback-Leibler distance from one multivariate normal 
+    distribution to each of :math:`K` others, as described in
+    `kullback_leibler_for_multivariate_normals`. All covariance matrices of the
+    other distributions are factorised and solved against in one batch.
+
+    :param mu_a:
+        The mean of the first multivariate normal distribution.
+
+    :param cov_a:
+        The covariance matrix of the first multivariate normal distribution.
+
+    :param mu_b:
+        The means of the other distributions, with shape :math:`(K, D)`.
+
+    :param cov_b:
+        The covariance matrices of the other distributions, with shape
+        :math:`(K, D, D)`, or :math:`(K, D)` for diagonal covariance matrices.
     """
-    Return the mixture parameter value that has the lowest cost for each K.
+
+    K, D = mu_b.shape
+    offset = mu_b - mu_a
+
+    if cov_a.ndim == 1 and cov_b.ndim == 2:
+        return 0.5 * np.sum(
+            (cov_a + offset**2)/cov_b - 1 + np.log(cov_b) - np.log(cov_a),
+            axis=1)
+
+    if cov_a.ndim == 1:
+        cov_a = np.diag(cov_a)
+
+    if cov_b.ndim == 2:
+        diagonals = cov_b
+        cov_b = np.zeros((K, D, D))
+        np.einsum("kii->ki", cov_b)[:] = diagonals
+
+    L_a = np.linalg.cholesky(cov_a)
+    L_b = np.linalg.cholesky(cov_b)
+
+    # NumPy has no batched triangular solve, but a batched general solve on 
+    # the stacked factors is still a single call.
+    Z = np.linalg.solve(L_b, np.concatenate(
+        [np.broadcast_to(L_a, (K, D, D)), offset[:, :, np.newaxis]], axis=2))
+
+    trace = np.sum(Z[:, :, :D]**2, axis=(1, 2))
+    mahalanobis = np.sum(Z[:, :, D]**2, axis=1)
+    log_det_ratio = 2 * (
+        np.sum(np.log(np.diagonal(L_b, axis1=1, axis2=2)), axis=1) \
+      - np.sum(np.log(np.diag(L_a))))
+
+    return 0.5 * (trace + mahalanobis - D + log_det_ratio)
+
+
+def _pairwise_kullback_leibler_for_multivariate_normals(means, covs):
+    r"""
+    Return the Kullback-Leibler distance from each of :math:`K` multivariate
+    normal distributions to each of the others, as described in
+    `kullback_leibler_for_multivariate_normals`. Every covariance matrix is
+    factorised and inverted once, so the distances between all pairs only
+    need matrix products.
+
+    :param means:
+        The means of the distributions, with shape :math:`(K, D)`.
+
+    :param covs:
+        The covariance matrices of the distributions, with shape
+        :math:`(K, D, D)`, or :math:`(K, D)` for diagonal covariance matrices.
+
+    :returns:
+        A :math:`(K, K)` array where the :math:`(a, b)`-th entry is the
+        distance from distribution :math:`a` to :math:`b`, in units of nats.
     """
 
-    K = np.atleast_1d(K)
-    I = np.atleast_1d(I)
+    K, D = means.shape
 
-    unique_K = np.unique(K)
-    best_value = np.empty(unique_K.size)
+    # offset[a, b] is the offset from the mean of a to the mean of b.
+    offset = means[np.newaxis] - means[:, np.newaxis]
 
-    for i, k in enumerate(unique_K):
+    if covs.ndim == 2:
+        return 0.5 * np.sum(
+            (covs[:, np.newaxis] + offset**2)/covs[np.newaxis] - 1 \
+            + np.log(covs[np.newaxis]) - np.log(covs[:, np.newaxis]), axis=2)
 
-        idxs = np.where((K == k))[0]
-        min_idx = np.argmin(I[idxs])
+    L = np.linalg.cholesky(covs)
+    L_inv = np.linalg.solve(L, np.broadcast_to(np.eye(D), (K, D, D)))
+    precisions = np.matmul(L_inv.transpose(0, 2, 1), L_inv)
 
-        best_value[i] = value[idxs[min_idx]]
+    trace = np.einsum("bij,aij->ab", precisions, covs)
+    mahalanobis = np.sum(np.einsum("bij,abj->abi", L_inv, offset)**2, axis=2)
+    log_det = 2 * np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1)
 
-    return (unique_K, best_value)
+    return 0.5 * (trace + mahalanobis - D \
+                  + log_det[np.newaxis] - log_det[:, np.newaxis])
 
 
 
-def _group_over(x, y, function):
+def _best_mixture_parameter_values(K, I, value):
+    """
+    Return the mixture parameter value that has the lowest cost for each K.
+    """
 
-    x = np.atleast_1d(x)
-    y = np.atleast_1d(y)
+    K = np.atleast_1d(K)
+    I = np.atleast_1d(I)
+    value = np.atleast_1d(value).astype(float)
 
-    x_unique = np.sort(np.unique(x))
-    y_unique = np.nan * np.ones_like(x_unique)
+    # Sort by K, and then by I, so the first entry for each K is the best.
+    indices = np.lexsort((I, K))
+    unique_K, first = np.unique(K[indices], return_index=True)
 
-    for i, xi in enumerate(x_unique):
-        match = (x == xi)
-        y_unique[i] = function(y[match])
+    return (unique_K, value[indices[first]])
 
-    return (x_unique, y_unique)
 
 
 def concentration(y, K_max=None):
@@ -122,6 +210,8 @@ def concentration(y, K_max=None):
     set o
     """
 
+    from sklearn.neighbors import NearestNeighbors
+
     y = np.atleast_2d(y)
     N, D = y.shape
 
@@ -189,6 +279,8 @@ def concentration_hard(y, K_max=None):
     set o
     """
 
+    from sklearn.neighbors import NearestNeighbors
+
     y = np.atleast_2d(y)
     N, D = y.shape
 
@@ -196,14 +288,10 @@ def concentration_hard(y, K_max=None):
         K_max = N
 
     knn = NearestNeighbors().fit(y)
-    distances, indices = knn.kneighbors(y, n_neighbors=int(N/2))
-    
-    estimated_cumulative_log_det = np.cumsum(
-        D * np.log((distances[:, 1:]/(2 * D))**2), axis=1)
+    distances, indices = knn.kneighbors(y, n_neighbors=2)
 
-    estimated_cumulative_concentration = estimated_cumulative_log_det \
-                                       * np.arange(2, 1 + distances.shape[1]) \
-                                       / N
+    # Order the pairs of nearest neighbours by their separation.
+    closest_indices = np.argsort(distances.T[1])
 
     # Successively build up the minimum concentration.
     K = np.arange(2, 1 + K_max, dtype=int)
@@ -212,18 +300,7 @@ def concentration_hard(y, K_max=None):
 
         assigned = np.zeros(N, dtype=bool)
 
-        ecc = np.copy(estimated_cumulative_concentration)
-
-        min_index = np.argmin(estimated_cumulative_concentration)
-        xi, yi = int(min_index / ecc.shape[1]), min_index % ecc.shape[1]
-
-        raise a
-        #for K = 2 we are looking for 
-
-
         # Find the closest and smallest k-1 mixtures
-        closest_indices = np.argsort(distances.T[1])
-
         components, concentration = (0, 0)
 
         for index in closest_indices:
@@ -241,8 +318,6 @@ def concentration_hard(y, K_max=None):
         weight = (N - (k-1) * 2)/float(N)
         minimum_mixture_concentration[i] = concentration + weight * sum_log_det
 
-        print(k, minimum_mixture_concentration[i])
-
     return (K, minimum_mixture_concentration)
 
 def aggregate(x, y, function):
@@ -271,16 +346,85 @@ def aggregate(x, y, function):
     if x.size != y.size:
         raise ValueError("x and y must be the same size")
 
-    x_unique = np.sort(np.unique(x))
-    y_aggregated = np.nan * np.ones_like(x_unique)
+    # Sort the y values into contiguous groups of each unique x value.
+    x_unique, inverse = np.unique(x, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    y_sorted = y[order].astype(float)
+    groups = inverse[order]
+    starts = np.flatnonzero(np.diff(groups, prepend=-1))
+
+    reduction = _aggregate_reductions.get(function, None)
+    grouped_function = _aggregate_functions.get(function, None)
+    if reduction is not None:
+        y_aggregated = reduction.reduceat(y_sorted, starts)
 
-    for i, xi in enumerate(x_unique):
-        match = (x == xi)
-        y_aggregated[i] = function(y[match])
+    elif grouped_function is not None:
+        y_aggregated = grouped_function(y_sorted, groups, starts)
+
+    else:
+        y_aggregated = np.array([function(group) \
+            for group in np.split(y_sorted, starts[1:])], dtype=float)
 
     return (x_unique, y_aggregated)
 
 
+def _grouped_mean(values, groups, starts):
+    r"""
+    Return the mean of contiguous groups of values.
+
+    :param values:
+        An array of values, sorted into contiguous groups.
+
+    :param groups:
+        The group index of each value.
+
+    :param starts:
+        The index of the first value in each group.
+    """
+    return np.add.reduceat(values, starts) / np.diff(starts, append=values.size)
+
+
+def _grouped_median(values, groups, starts):
+    r"""
+    Return the median of contiguous groups of values.
+
+    :param values:
+        An array of values, sorted into contiguous groups.
+
+    :param groups:
+        The group index of each value.
+
+    :param starts:
+        The index of the first value in each group.
+    """
+
+    # Sort the values within each group, which keeps the groups in place.
+    values = values[np.lexsort((values, groups))]
+    counts = np.diff(starts, append=values.size)
+
+    median = 0.5 * (values[starts + (counts - 1) // 2] \
+                  + values[starts + counts // 2])
+
+    # Like np.median, any group containing NaN has a NaN median.
+    median[np.add.reduceat(np.isnan(values), starts) > 0] = np.nan
+    return median
+
+
+_aggregate_reductions = {
+    np.min: np.minimum,
+    np.max: np.maximum,
+    np.sum: np.add,
+    min: np.minimum,
+    max: np.maximum,
+    sum: np.add
+}
+
+_aggregate_functions = {
+    np.mean: _grouped_mean,
+    np.median: _grouped_median
+}
+
+
 
 
 def generate_data(N, D, K=None, dirichlet_concentration=1, isotropy=10, psi=0.05,
@@ -353,15 +497,13 @@ def generate_data(N, D, K=None, dirichlet_concentration=1, isotropy=10, psi=0.05
     # Generate covariance matrices.
     phi = np.abs(np.random.normal(0, psi, size=(K, D)))
 
-    I = np.eye(D)
-    covs = np.empty((K, D, D))
-    for k, diag in enumerate(phi):
-
-        covs[k] = I * diag
-
-        for i, j in zip(*np.tril_indices(D, -1)):
-            value = rho(1) * diag[i] * diag[j]
-            covs[k, i, j] = covs[k, j, i] = value
+    # The correlation coefficients are drawn in the same order as filling in
+    # the lower triangle of each covariance matrix in turn.
+    i, j = np.tril_indices(D, -1)
+    covs = np.zeros((K, D, D))
+    covs[:, np.arange(D), np.arange(D)] = phi
+    covs[:, i, j] = covs[:, j, i] \
+                  = rho(K * i.size).reshape((K, -1)) * phi[:, i] * phi[:, j]
 
     # Draw samples from each component to generate the data.
     members = np.round(N * weights).astype(int)
@@ -374,11 +516,11 @@ def generate_data(N, D, K=None, dirichlet_concentration=1, isotropy=10, psi=0.05
 
     X = np.empty((N, D))
     R = np.zeros(N, dtype=int)
+    R[:members.sum()] = np.repeat(np.arange(K), members)
 
-    for i, (m, mean, cov) in enumerate(zip(members, means, covs)):
-        si = int(np.sum(members[:i]))
+    offsets = np.cumsum(members) - members
+    for si, m, mean, cov in zip(offsets, members, means, covs):
         X[si:si + m] = np.random.multivariate_normal(mean, cov, size=m)[:N-si]
-        R[si:si + m] = i
 
     # Shuffle the order.
     idx = np.random.choice(np.arange(N), N, replace=False)
@@ -404,6 +546,8 @@ def generate_data(N, D, K=None, dirichlet_concentration=1, isotropy=10, psi=0.05
 def generate_isotropic_data(N=None, D=None, K=None, cluster_std=1.0, 
     center_box=(-10, 10.0), shuffle=True, random_state=None):
 
+    from sklearn import datasets
+
     if K is None:
         K = max(1, abs(int(np.random.normal(0, 100))))
 
@@ -416,6 +560,7 @@ def generate_isotropic_data(N=None, D=None, K=None, cluster_std=1.0,
     kwds = dict(n_samples=N, n_features=D, centers=K,
         cluster_std=cluster_std, center_box=center_box, shuffle=shuffle,
         random_state=random_state)
+
     X, y = datasets.make_blobs(**kwds)
 
     # Estimate true values from the blobs:
@@ -425,12 +570,10 @@ def generate_isotropic_data(N=None, D=None, K=None, cluster_std=1.0,
     responsibility[y, np.arange(N)] = 1.0
     membership = responsibility.sum(axis=1)
 
-    mean = np.zeros((K, D))
-    for k in range(K):
-        mean[k] = np.sum(responsibility[k] * X.T, axis=1) / membership[k]
+    mean = np.dot(responsibility, X) / membership[:, np.newaxis]
 
-    from .em import responsibilities, _estimate_covariance_matrix_full
-    from .mml import gaussian_mixture_message_length
+    from .em import expectation, _estimate_covariance_matrix_full
+    from .mml import total_message_length
 
     cov = _estimate_covariance_matrix_full(X, mean, responsibility)
     
@@ -440,18 +583,13 @@ def generate_isotropic_data(N=None, D=None, K=None, cluster_std=1.0,
 
 
     
-    responsibility, log_likelihood = responsibilities(
-        X, mean, cov, weight, full_output=True, covariance_type="full")
+    # The expectation step takes the log of the determinants of the covariance
+    # matrices from the same factorisation used for the responsibilities.
+    responsibility, log_likelihood, I_parts = expectation(
+        X, mean, cov, weight, covariance_type="full")
 
     nll = -np.sum(log_likelihood)
-    #I, I_parts = _message_length(X, mean, cov, weight, responsibility, nll,
-    #    full_output=True, covariance_type="full")
-
-    _, slogdetcovs = np.linalg.slogdet(cov)
-    I_parts = gaussian_mixture_message_length(K, N, D, -nll, np.sum(slogdetcovs),
-        [weight])
-
-    I = np.sum(I_parts.values())
+    I = total_message_length(I_parts)
 
     target = dict(mean=mean, cov=cov, weight=weight, I=I, I_parts=I_parts,
         nll=nll)
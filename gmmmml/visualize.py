@@ -279,7 +279,7 @@ class VisualizationHandler(object):
             if not self._show_intermediate_steps:
                 data = np.vstack(utils._best_mixture_parameter_values(
                     data.T[0], np.hstack(self._actual_message_lengths), data.T[1])).T
-                #data = np.vstack(utils._group_over(data.T[0], data.T[1], np.min)).T
+                #data = np.vstack(utils.aggregate(data.T[0], data.T[1], np.min)).T
 
             scat.set_offsets(data)
             scat.set_facecolor(self._colours["data"])
@@ -304,7 +304,7 @@ class VisualizationHandler(object):
                 data = np.vstack(utils._best_mixture_parameter_values(
                     data.T[0], np.hstack(self._actual_message_lengths), data.T[1])).T
 
-                #data = np.vstack(utils._group_over(data.T[0], data.T[1], np.min)).T
+                #data = np.vstack(utils.aggregate(data.T[0], data.T[1], np.min)).T
 
             scat.set_offsets(data)
             scat.set_facecolor(self._colours["data"])
@@ -382,7 +382,7 @@ class VisualizationHandler(object):
                 data = np.vstack(utils._best_mixture_parameter_values(
                     data.T[0], np.hstack(self._actual_message_lengths), data.T[1])).T
 
-                #data = np.vstack(utils._group_over(data.T[0], data.T[1], np.min)).T
+                #data = np.vstack(utils.aggregate(data.T[0], data.T[1], np.min)).T
 
             scat.set_offsets(data)
             scat.set_facecolor(self._colours["data"])
@@ -458,7 +458,7 @@ class VisualizationHandler(object):
                 data = np.vstack(utils._best_mixture_parameter_values(
                     data.T[0], np.hstack(self._actual_message_lengths), data.T[1])).T
 
-                #data = np.vstack(utils._group_over(data.T[0], data.T[1], np.min)).T
+                #data = np.vstack(utils.aggregate(data.T[0], data.T[1], np.min)).T
 
             scat.set_offsets(data)
             scat.set_facecolor(self._colours["data"])
@@ -36,7 +36,8 @@ setup(
         "Programming Language :: Python :: 3.6"
     ],
     packages=find_packages(exclude=["tests"]),
-    install_requires=["numpy", "scipy", "matplotlib", "sklearn", "six", "tqdm"],
+    install_requires=["numpy", "scipy", "matplotlib", "sklearn", "joblib>=1.3", "six",
+                      "tqdm"],
     extras_require={
         "test": ["coverage"]
     },